@@ -0,0 +1,42 @@
+from sqlalchemy import func
+from database import SessionLocal, engine
+from models import Base, Analysis, AnalysisStatus, UserStats, Video
+from services.user_stats import empty_stats, add_contribution, category_of
+
+def backfill_user_stats():
+    """
+    Rebuilds user_stats from videos and analyses. Run it once after deploying
+    the table (or whenever it drifted); stop the workers first so no analysis
+    completes while the rows are rewritten.
+    """
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        stats = {}
+        for user_id, count in db.query(Video.user_id, func.count(Video.id)).filter(Video.user_id.isnot(None)).group_by(Video.user_id):
+            stats[user_id] = empty_stats(user_id)
+            stats[user_id]["video_count"] = count
+
+        ranked = db.query(
+            Analysis.video_id, Analysis.overall_score, Analysis.context_key,
+            func.row_number().over(partition_by=Analysis.video_id, order_by=(Analysis.created_at.desc(), Analysis.id.desc())).label("rank"),
+        ).filter(Analysis.status == AnalysisStatus.COMPLETED).subquery()
+        latest = db.query(Video.user_id, ranked.c.overall_score, ranked.c.context_key) \
+            .join(ranked, ranked.c.video_id == Video.id).filter(ranked.c.rank == 1, Video.user_id.isnot(None))
+        for user_id, score, context_key in latest.yield_per(1000):
+            if score is not None:
+                add_contribution(stats.setdefault(user_id, empty_stats(user_id)), (score, category_of(context_key)))
+
+        db.query(UserStats).delete(synchronize_session=False)
+        for row in stats.values():
+            db.add(UserStats(**row))
+        db.commit()
+        print(f"Backfilled user_stats for {len(stats)} users.")
+    except Exception as e:
+        print(f"Error backfilling user_stats: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    backfill_user_stats()
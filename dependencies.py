@@ -1,28 +1,72 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
+from typing import Optional
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, get_async_db, SessionLocal
 from models import User
 from utils import SECRET_KEY, ALGORITHM
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def email_from_token(token: str) -> str:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
+            raise credentials_exception()
     except JWTError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.email == email).first()
+        raise credentials_exception()
+    return email
+
+def user_from_token(token: str, db: Session) -> User:
+    user = db.query(User).filter(User.email == email_from_token(token)).first()
+    if user is None:
+        raise credentials_exception()
+    return user
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return user_from_token(token, db)
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """
+    get_current_user for handlers on get_async_db; the user is loaded into
+    (and can be modified through) the handler's own session.
+    """
+    user = (await db.execute(select(User).where(User.email == email_from_token(token)))).scalar_one_or_none()
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
     return user
+
+def get_current_user_stream(
+    token: Optional[str] = Query(None),
+    header_token: Optional[str] = Depends(oauth2_scheme_optional),
+):
+    """
+    Like get_current_user, but also accepts the JWT as `?token=`, since
+    EventSource cannot send an Authorization header. The user is loaded in a
+    short-lived session: a get_db session would hold its pooled connection
+    for as long as the stream stays open.
+    """
+    token = header_token or token
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    db = SessionLocal()
+    try:
+        return user_from_token(token, db) # detached once closed; loaded attributes stay readable
+    finally:
+        db.close()
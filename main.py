@@ -1,9 +1,12 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from database import engine, Base, SessionLocal, get_db
-from routers import videos, auth, razorpay
+from routers import videos, uploads, auth, razorpay
 from models import User, PlanType, Video, Analysis, Review
 from schemas import ReviewCreate, ReviewOut
+from services.events import start_event_listener
+from services import metrics
+from services.pagination import NEXT_CURSOR_HEADER
 from typing import List
 from sqlalchemy.orm import Session
 from fastapi.staticfiles import StaticFiles
@@ -13,6 +16,16 @@ import os
 Base.metadata.create_all(bind=engine)
 
 from sqlalchemy import text
+
+def add_column_if_missing(connection, table: str, column: str, ddl: str):
+    try:
+        result = connection.execute(text(f"SELECT column_name FROM information_schema.columns WHERE table_name='{table}' AND column_name='{column}'"))
+        if not result.fetchone():
+            print(f"Migrating: Adding '{column}' column to {table} table...")
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl}"))
+    except Exception as e:
+        print(f"Migration warning ({column}): {e}")
+
 def run_migrations():
     try:
         with engine.connect() as connection:
@@ -45,6 +58,46 @@ def run_migrations():
                     connection.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS verification_token VARCHAR"))
             except Exception as e:
                 print(f"Migration warning (verification_token): {e}")
+
+            # Content-addressed uploads / analysis reuse
+            add_column_if_missing(connection, "videos", "content_hash", "VARCHAR")
+            add_column_if_missing(connection, "analyses", "context_key", "VARCHAR")
+            try:
+                connection.execute(text("CREATE INDEX IF NOT EXISTS ix_videos_content_hash ON videos (content_hash)"))
+            except Exception as e:
+                print(f"Migration warning (ix_videos_content_hash): {e}")
+
+            # Link import pre-probe / dedup
+            add_column_if_missing(connection, "videos", "source_key", "VARCHAR")
+            try:
+                connection.execute(text("CREATE INDEX IF NOT EXISTS ix_videos_source_key ON videos (source_key)"))
+            except Exception as e:
+                print(f"Migration warning (ix_videos_source_key): {e}")
+
+            # Hook-first preliminary results (Postgres native enum; SQLite stores plain strings)
+            if connection.dialect.name == "postgresql":
+                try:
+                    connection.execute(text("ALTER TYPE analysisstatus ADD VALUE IF NOT EXISTS 'PARTIAL'"))
+                except Exception as e:
+                    print(f"Migration warning (analysisstatus PARTIAL): {e}")
+                # Resumable upload completion claim (routers/uploads.py)
+                try:
+                    connection.execute(text("ALTER TYPE uploadsessionstatus ADD VALUE IF NOT EXISTS 'COMPLETING'"))
+                except Exception as e:
+                    print(f"Migration warning (uploadsessionstatus COMPLETING): {e}")
+
+            # Latest analysis per video in one query (video listing)
+            try:
+                connection.execute(text("CREATE INDEX IF NOT EXISTS ix_analyses_video_id_created_at ON analyses (video_id, created_at DESC)"))
+            except Exception as e:
+                print(f"Migration warning (ix_analyses_video_id_created_at): {e}")
+
+            # Keyset pagination (services/pagination.py)
+            try:
+                connection.execute(text("CREATE INDEX IF NOT EXISTS ix_videos_user_id_created_at_id ON videos (user_id, created_at DESC, id DESC)"))
+                connection.execute(text("CREATE INDEX IF NOT EXISTS ix_analyses_user_id_created_at_id ON analyses (user_id, created_at DESC, id DESC)"))
+            except Exception as e:
+                print(f"Migration warning (keyset pagination indexes): {e}")
                 
     except Exception as e:
         print(f"Migration failed: {e}")
@@ -72,6 +125,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 @app.get("/debug/migrate")
@@ -86,6 +140,13 @@ def force_migrate(db: Session = Depends(get_db)):
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@app.get("/debug/metrics")
+def debug_metrics():
+    """
+    Counters of this API process (the worker logs its own periodically).
+    """
+    return metrics.snapshot()
+
 @app.get("/debug/email")
 def debug_email_connection():
     """
@@ -147,7 +208,13 @@ def create_review(review: ReviewCreate, db: Session = Depends(get_db)):
     db.refresh(db_review)
     return db_review
 
+@app.on_event("startup")
+def start_event_listener_on_startup():
+    # Worker -> SSE clients (routers/videos.py) via Postgres NOTIFY
+    start_event_listener()
+
 app.include_router(auth.router)
+app.include_router(uploads.router)
 app.include_router(videos.router)
 app.include_router(razorpay.router)
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, JSON, Enum, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, ForeignKey, DateTime, JSON, Enum, Float, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -13,9 +13,26 @@ class AnalysisStatus(str, enum.Enum):
     QUEUED = "queued"
     PROCESSING = "processing"
     ANALYZING = "analyzing"
+    PARTIAL = "partial" # preliminary hook score is in, full analysis still running
     COMPLETED = "completed"
     FAILED = "failed"
 
+class UploadSessionStatus(str, enum.Enum):
+    ACTIVE = "active"
+    COMPLETING = "completing"
+    COMPLETED = "completed"
+
+class LinkFetchStatus(str, enum.Enum):
+    FETCHING = "fetching"
+    READY = "ready"
+    FAILED = "failed"
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -52,8 +69,10 @@ class Video(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     source_type = Column(String) # "upload" or "link"
     source_url = Column(String, nullable=True)
+    source_key = Column(String, nullable=True, index=True) # "<extractor>:<video id>" for link imports
     title = Column(String, nullable=True) # Original filename or video title
     storage_path = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True, index=True) # SHA-256 of the stored file
     script_content = Column(String, nullable=True)
     duration = Column(Integer, nullable=True) # in seconds
     platform_guess = Column(String, nullable=True)
@@ -62,6 +81,9 @@ class Video(Base):
     owner = relationship("User", back_populates="videos")
     analyses = relationship("Analysis", back_populates="video")
 
+    # Keyset pagination of a user's library (services/pagination.py)
+    __table_args__ = (Index("ix_videos_user_id_created_at_id", "user_id", created_at.desc(), id.desc()),)
+
 class Analysis(Base):
     __tablename__ = "analyses"
 
@@ -75,12 +97,19 @@ class Analysis(Base):
     insights = Column(JSON, nullable=True)
     optimized_assets = Column(JSON, nullable=True)
     checklist = Column(JSON, nullable=True)
+    context_key = Column(String, nullable=True) # "platform|category" the result was generated for
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="analyses")
     video = relationship("Video", back_populates="analyses")
 
+    # Latest analysis per video (video listing); keyset pagination of a user's history
+    __table_args__ = (
+        Index("ix_analyses_video_id_created_at", "video_id", created_at.desc()),
+        Index("ix_analyses_user_id_created_at_id", "user_id", created_at.desc(), id.desc()),
+    )
+
 class PlanUsage(Base):
     __tablename__ = "plan_usage"
 
@@ -102,3 +131,113 @@ class Review(Base):
     rating = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     is_approved = Column(Boolean, default=True) # Auto-approve for now
+
+class Job(Base):
+    """
+    Durable background job, claimed by worker processes (see worker.py).
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True) # "analysis" or "link_import"
+    payload = Column(JSON, nullable=True)
+    status = Column(Enum(JobStatus), default=JobStatus.QUEUED, index=True)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+
+    # Lease: a RUNNING job whose lease has expired is reclaimed by another worker
+    locked_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+
+    run_after = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class UploadSession(Base):
+    """
+    Resumable (chunked) upload in progress. Chunks are written at their
+    offset into a preallocated partial file; see routers/uploads.py.
+    """
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True, index=True) # opaque upload id
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    filename = Column(String)
+    total_size = Column(BigInteger)
+    status = Column(Enum(UploadSessionStatus), default=UploadSessionStatus.ACTIVE)
+    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+    chunks = relationship("UploadChunk", back_populates="session", cascade="all, delete-orphan")
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, ForeignKey("upload_sessions.id"), index=True)
+    offset = Column(BigInteger)
+    length = Column(BigInteger)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    session = relationship("UploadSession", back_populates="chunks")
+
+class LinkFetch(Base):
+    """
+    One download per linked video (keyed by Video.source_key), shared by every
+    import of that link; see services/link_cache.py.
+    """
+    __tablename__ = "link_fetches"
+
+    key = Column(String, primary_key=True) # "<extractor>:<video id>"
+    status = Column(Enum(LinkFetchStatus), default=LinkFetchStatus.FETCHING)
+    owner = Column(String, nullable=True) # who is downloading it right now
+    storage_path = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class GeminiFile(Base):
+    """
+    Registry of files uploaded to the Gemini File API, so re-analyses of the
+    same bytes reuse the remote copy until it expires; see services/gemini_files.py.
+    """
+    __tablename__ = "gemini_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_key = Column(String, unique=True, index=True) # content-addressed local path, see remote_file_key()
+    name = Column(String) # "files/..." on Gemini
+    expires_at = Column(DateTime(timezone=True), index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), nullable=True)
+
+class UserStats(Base):
+    """
+    Per-user dashboard aggregates, maintained in the same transaction as the
+    changes they summarize; see services/user_stats.py.
+    """
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    video_count = Column(Integer, default=0, nullable=False)
+    analyzed_count = Column(Integer, default=0, nullable=False) # videos with a scored, completed analysis
+    score_sum = Column(BigInteger, default=0, nullable=False) # over each video's latest completed analysis
+    score_histogram = Column(JSON, nullable=True) # {category: [count per 10-point bucket]}
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class CreditLedger(Base):
+    """
+    Append-only record of every credit movement; users.credits is its running
+    balance. Written only through services/credits.py.
+    """
+    __tablename__ = "credit_ledger"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=True, index=True)
+    kind = Column(String, nullable=False) # opening, debit, refund, purchase, adjustment
+    amount = Column(Float, nullable=False) # positive adds credits, negative charges them
+    balance_after = Column(Float, nullable=True)
+    idempotency_key = Column(String, unique=True, nullable=True) # e.g. "analysis:42:debit", "razorpay:pay_..."
+    reason = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
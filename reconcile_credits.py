@@ -0,0 +1,22 @@
+from database import SessionLocal, engine
+from models import Base
+from services.credits import reconcile_credits
+
+def run_reconciliation():
+    """
+    One-off run of the worker janitor's credit reconciliation, e.g. right
+    after deploying the ledger to give existing balances an opening entry.
+    """
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        result = reconcile_credits(db)
+        print(f"Refunded {result['refunded']} failed analyses, recorded {result['adjusted']} balance entries.")
+    except Exception as e:
+        print(f"Error reconciling credits: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_reconciliation()
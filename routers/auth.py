@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import timedelta
 import schemas, models, utils, database, uuid
+from dependencies import get_current_user_async
 from services.email import send_login_notification, send_verification_email
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
@@ -147,8 +149,8 @@ async def read_users_me(current_user: models.User = Depends(utils.get_current_us
 @router.put("/me", response_model=schemas.UserOut)
 async def update_user_me(
     user_update: schemas.UserUpdate,
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(utils.get_current_user)
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
 ):
     # Update fields if provided
     if user_update.full_name is not None:
@@ -160,8 +162,8 @@ async def update_user_me(
     if user_update.avg_length is not None:
         current_user.avg_length = user_update.avg_length
         
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
     return current_user
 
 @router.post("/verify")
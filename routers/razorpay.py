@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from dependencies import get_current_user_async
+from services.credits import grant_credits
 from models import User, PlanType
 from pydantic import BaseModel
 import razorpay
@@ -73,8 +75,8 @@ async def create_order(
 @router.post("/verify")
 async def verify_payment(
     request: PaymentVerificationRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(utils.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """
     Verify Razorpay payment signature and upgrade user.
@@ -99,18 +101,24 @@ async def verify_payment(
         # Update user plan
         # In a real app, verify details from order_id against DB or Razorpay API
         
+        amount = 0.0
         if request.plan == 'pro':
             current_user.plan = PlanType.PRO
-            current_user.credits += 50.0 # Add 50 credits
+            amount = 50.0 # Add 50 credits
         elif request.plan == 'agency':
             current_user.plan = PlanType.AGENCY
-            current_user.credits += 110.0 # Add 110 credits
+            amount = 110.0 # Add 110 credits
         elif request.plan == 'starter':
             # Starter Pack: Just add credits, don't change plan type (or keep as is)
-            current_user.credits += 15.0 # Add 15 credits
+            amount = 15.0 # Add 15 credits
+
+        if amount:
+            # Keyed by payment id: verifying the same payment again adds nothing
+            user_id, key = current_user.id, f"razorpay:{request.razorpay_payment_id}"
+            await db.run_sync(lambda session: grant_credits(session, user_id, amount, key=key, reason=f"{request.plan} plan"))
             
-        db.commit()
-        db.refresh(current_user)
+        await db.commit()
+        await db.refresh(current_user)
             
         return {"status": "success", "message": f"Payment verified. Upgraded to {request.plan} and credits added."}
             
@@ -0,0 +1,286 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Header, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+import os
+import shutil
+import uuid
+from database import get_db
+from models import User, UploadSession, UploadChunk, UploadSessionStatus
+from schemas import UploadSessionCreate, UploadSessionOut, AnalysisOut
+from services.storage import PARTIAL_DIR, CHUNK_SIZE, store_file
+from services.media_probe import StreamingProbe, probe_media
+from routers.videos import check_can_start_analysis, early_upload_check, create_upload_analysis
+from dependencies import get_current_user
+
+router = APIRouter(
+    prefix="/api/videos/uploads",
+    tags=["uploads"]
+)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(4 * 1024 * 1024 * 1024))) # 4 GB
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+
+def partial_path(upload_id: str) -> str:
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+def received_ranges(session: UploadSession) -> list:
+    """
+    Merges the recorded chunks into sorted, non-overlapping (start, end) ranges.
+    """
+    ranges = []
+    for chunk in sorted(session.chunks, key=lambda c: c.offset):
+        start, end = chunk.offset, chunk.offset + chunk.length
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+def session_out(session: UploadSession) -> UploadSessionOut:
+    if session.status == UploadSessionStatus.COMPLETED:
+        offset = received = session.total_size
+    else:
+        ranges = received_ranges(session)
+        offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        received = sum(end - start for start, end in ranges)
+    return UploadSessionOut(
+        id=session.id,
+        filename=session.filename,
+        size=session.total_size,
+        offset=offset,
+        received=received,
+        status=session.status.value,
+        analysis_id=session.analysis_id
+    )
+
+def get_session(upload_id: str, user: User, db: Session) -> UploadSession:
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id, UploadSession.user_id == user.id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+def delete_session(db: Session, session: UploadSession):
+    if os.path.exists(partial_path(session.id)):
+        os.remove(partial_path(session.id))
+    db.delete(session)
+    db.commit()
+
+def _write_at(path: str, data: bytes, offset: int):
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    finally:
+        os.close(fd)
+
+def _create_session(db: Session, user: User, filename: str, size: int) -> UploadSession:
+    check_can_start_analysis(user, db)
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        filename=filename,
+        total_size=size,
+        status=UploadSessionStatus.ACTIVE
+    )
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    # Preallocate (sparse) so chunks can be written at any offset, in parallel
+    with open(partial_path(session.id), "wb") as f:
+        f.truncate(size)
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    print(f"Resumable upload {session.id} started: {filename} ({size} bytes) for User ID: {user.id}")
+    return session
+
+@router.post("", response_model=UploadSessionOut, status_code=201)
+def create_upload(
+    data: UploadSessionCreate,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Starts a resumable upload. Send the bytes with PATCH /{id} (any order,
+    in parallel if you like), then POST /{id}/complete.
+    """
+    if data.size <= 0 or data.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=400, detail=f"Upload size must be between 1 and {MAX_UPLOAD_BYTES} bytes")
+
+    filename = os.path.basename(data.filename) or "upload.mp4"
+    session = _create_session(db, current_user, filename, data.size)
+    response.headers["Location"] = f"{router.prefix}/{session.id}"
+    response.headers["Upload-Offset"] = "0"
+    return session_out(session)
+
+@router.get("/{upload_id}", response_model=UploadSessionOut)
+def get_upload(upload_id: str, response: Response, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Reports how far the upload got. Resume from `offset` (or fill the gaps if
+    chunks were sent in parallel).
+    """
+    out = session_out(get_session(upload_id, current_user, db))
+    response.headers["Upload-Offset"] = str(out.offset)
+    response.headers["Upload-Length"] = str(out.size)
+    return out
+
+@router.patch("/{upload_id}", response_model=UploadSessionOut)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Writes the raw request body at `Upload-Offset`.
+    """
+    session = await run_in_threadpool(get_session, upload_id, current_user, db)
+    if session.status != UploadSessionStatus.ACTIVE:
+        raise HTTPException(status_code=409, detail="Upload already completed")
+    if upload_offset < 0 or upload_offset >= session.total_size:
+        raise HTTPException(status_code=400, detail="Upload-Offset out of range")
+
+    path = partial_path(session.id)
+    # The first chunk carries the container headers: reject over-length videos now
+    probe = StreamingProbe() if upload_offset == 0 else None
+    check = early_upload_check(current_user)
+
+    position = upload_offset
+    pending = bytearray()
+    try:
+        async for data in request.stream():
+            pending += data
+            if position + len(pending) > session.total_size:
+                raise HTTPException(status_code=400, detail="Chunk exceeds declared upload size")
+            if probe is not None:
+                media = probe.feed(data)
+                if media is not None:
+                    probe = None
+                    try:
+                        check(media)
+                    except HTTPException:
+                        # Too long or unaffordable: nothing to resume
+                        await run_in_threadpool(delete_session, db, session)
+                        raise
+            if len(pending) >= CHUNK_SIZE:
+                await run_in_threadpool(_write_at, path, bytes(pending), position)
+                position += len(pending)
+                pending.clear()
+        if pending:
+            await run_in_threadpool(_write_at, path, bytes(pending), position)
+            position += len(pending)
+    finally:
+        # Whatever reached the disk counts, so a dropped connection can resume
+        if position > upload_offset:
+            await run_in_threadpool(_record_chunk, db, session, upload_offset, position - upload_offset)
+
+    out = session_out(session)
+    response.headers["Upload-Offset"] = str(out.offset)
+    return out
+
+def _record_chunk(db: Session, session: UploadSession, offset: int, length: int):
+    if not db.query(UploadSession).filter(UploadSession.id == session.id).first():
+        return
+    db.add(UploadChunk(session_id=session.id, offset=offset, length=length))
+    session.updated_at = datetime.now(timezone.utc)
+    db.commit()
+    db.refresh(session)
+
+def _claim_completion(db: Session, session: UploadSession) -> bool:
+    # ACTIVE -> COMPLETING in one conditional UPDATE: only one /complete call assembles the file
+    claimed = db.query(UploadSession).filter(
+        UploadSession.id == session.id,
+        UploadSession.status == UploadSessionStatus.ACTIVE
+    ).update({"status": UploadSessionStatus.COMPLETING, "updated_at": datetime.now(timezone.utc)}, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+def _release_completion(db: Session, session: UploadSession, stored: dict = None):
+    """
+    Undoes a failed completion: puts the assembled file back in place and
+    reopens the session, so the client can retry (e.g. after a top-up).
+    """
+    db.rollback()
+    if stored and os.path.exists(stored["path"]):
+        if stored["created"]:
+            os.replace(stored["path"], partial_path(session.id))
+        else:
+            shutil.copyfile(stored["path"], partial_path(session.id))
+    db.query(UploadSession).filter(
+        UploadSession.id == session.id,
+        UploadSession.status == UploadSessionStatus.COMPLETING
+    ).update({"status": UploadSessionStatus.ACTIVE}, synchronize_session=False)
+    db.commit()
+
+def _complete(db: Session, session: UploadSession, user: User):
+    ranges = received_ranges(session)
+    if ranges != [(0, session.total_size)]:
+        missing = session.total_size - sum(end - start for start, end in ranges)
+        raise HTTPException(status_code=409, detail=f"Upload incomplete: {missing} bytes missing")
+    if not _claim_completion(db, session):
+        raise HTTPException(status_code=409, detail="Upload already completed")
+
+    path = partial_path(session.id)
+    stored = None
+    try:
+        # Duration and credits are checked while the bytes are still the upload's
+        media = None
+        try:
+            media = probe_media(path)
+        except Exception as e:
+            print(f"Error checking duration: {e}")
+        early_upload_check(user)(media or {})
+
+        stored = store_file(path, session.filename)
+        stored["media"] = media
+        analysis = create_upload_analysis(db, user, session.filename, stored)
+    except Exception:
+        _release_completion(db, session, stored)
+        raise
+
+    session.status = UploadSessionStatus.COMPLETED
+    session.analysis_id = analysis.id
+    db.query(UploadChunk).filter(UploadChunk.session_id == session.id).delete()
+    db.commit()
+    return analysis
+
+@router.post("/{upload_id}/complete", response_model=AnalysisOut)
+async def complete_upload(upload_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Assembles the uploaded file into storage and starts the analysis. If that
+    fails (e.g. 402 Insufficient credits) the upload stays resumable and this
+    can be called again.
+    """
+    session = await run_in_threadpool(get_session, upload_id, current_user, db)
+    if session.status != UploadSessionStatus.ACTIVE:
+        raise HTTPException(status_code=409, detail="Upload already completed")
+    return await run_in_threadpool(_complete, db, session, current_user)
+
+def gc_stale_uploads(db: Session) -> int:
+    """
+    Deletes resumable uploads (and their partial files) that have not
+    received a chunk for UPLOAD_SESSION_TTL_HOURS. Run periodically by the worker.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    # A COMPLETING session this old was interrupted (e.g. a restart mid-request)
+    stale = db.query(UploadSession).filter(
+        UploadSession.status.in_([UploadSessionStatus.ACTIVE, UploadSessionStatus.COMPLETING]),
+        UploadSession.updated_at < cutoff
+    ).all()
+    for session in stale:
+        print(f"Garbage-collecting stale upload {session.id} ({session.filename})")
+        delete_session(db, session)
+
+    # Completed sessions only need to stay around long enough to be looked up
+    db.query(UploadSession).filter(
+        UploadSession.status == UploadSessionStatus.COMPLETED,
+        UploadSession.updated_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    return len(stale)
@@ -1,253 +1,259 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks, Response
-from sqlalchemy.orm import Session
-from typing import List
-import shutil
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from typing import List, Optional
+from datetime import datetime
 import os
 import io
+import json
+import time
+import asyncio
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from database import get_db, SessionLocal
+from database import get_db, get_async_db, SessionLocal
 from models import Video, Analysis, User, AnalysisStatus, PlanType
 from schemas import VideoOut, VideoCreate, AnalysisOut, ScriptCreate
-from services.video_processor import download_video, extract_audio, extract_frames
-from services.gemini_analyzer import analyze_video_content, analyze_script_content
-from dependencies import get_current_user
+from services.job_queue import enqueue_job, JOB_ANALYSIS, JOB_LINK_IMPORT
+from services.storage import save_upload, UploadWriter, CHUNK_SIZE
+from services.media_probe import probe_media
+from services.credits import MAX_DURATION_SECONDS, SCRIPT_COST, InsufficientCredits, cost_for_duration, debit_credits
+from services.analysis_cache import build_context, find_reusable_analysis, copy_result
+from services.events import broker, analysis_topic, user_topic, uses_notify
+from services.user_stats import stats_overview
+from services.pagination import DEFAULT_PAGE_SIZE, NEXT_CURSOR_HEADER, keyset_page, next_cursor
+from dependencies import get_current_user, get_current_user_async, get_current_user_stream
 
 router = APIRouter(
     prefix="/api/videos",
     tags=["videos"]
 )
 
-UPLOAD_DIR = "uploads"
+# Raw streaming uploads are coalesced into writes of this size
+STREAM_WRITE_BYTES = CHUNK_SIZE
 
-def process_analysis(analysis_id: int, video_path: str):
-    """
-    Background task to run the full analysis pipeline.
-    """
-    db = SessionLocal()
-    try:
-        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
-        if not analysis:
-            return
-
-        analysis.status = AnalysisStatus.PROCESSING
-        db.commit()
-
-        # 1. Extract Audio & Frames (if needed for local processing, but we use Gemini File API now)
-        # We might still want frames for UI later, but for now let's skip to save time if Gemini handles video.
-        # But wait, we might want to show frames in the report.
-        # Let's extract frames for the UI.
-        # frames = extract_frames(video_path)
-        
-        # 2. Analyze with Gemini
-        analysis.status = AnalysisStatus.ANALYZING
-        db.commit()
-        
-        # Context for Gemini
-        context = {
-            "platform": analysis.video.platform_guess or "Unknown",
-            "category": analysis.user.primary_category if analysis.user else "General"
-        }
-        
-        if analysis.video.source_type == "script":
-            result = analyze_script_content(analysis.video.script_content, context)
-        else:
-            result = analyze_video_content(video_path, None, None, context)
-        
-        # Validate result
-        if not result or "overall_score" not in result:
-             raise ValueError(f"Analysis returned incomplete data: {result}")
-
-        # 3. Save Results
-        analysis.overall_score = result.get("overall_score")
-        analysis.subscores = result.get("subscores")
-        analysis.insights = result.get("insights")
-        analysis.optimized_assets = result.get("optimized_assets")
-        analysis.checklist = result.get("checklist")
-        analysis.status = AnalysisStatus.COMPLETED
-        db.commit()
-
-    except Exception as e:
-        import traceback
-        print(f"CRITICAL ANALYSIS FAILURE ID {analysis_id}: {e}")
-        traceback.print_exc() # This prints to stderr which Railway captures
-        
-        with open("error.log", "a") as f:
-            f.write(f"Analysis ID {analysis_id} Failed:\n")
+# SSE: comment line this often to keep proxies from closing idle streams
+SSE_KEEPALIVE_SECONDS = int(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+# Fallback re-read interval when events can't cross processes (no Postgres)
+SSE_RECHECK_SECONDS = int(os.getenv("SSE_RECHECK_SECONDS", "5"))
+FINAL_STATUSES = (AnalysisStatus.COMPLETED, AnalysisStatus.FAILED)
 
 def check_credits(user: User, amount: float):
     if user.credits < amount:
         raise HTTPException(status_code=402, detail="Insufficient credits")
 
+ACTIVE_STATUSES = (AnalysisStatus.QUEUED, AnalysisStatus.PROCESSING, AnalysisStatus.ANALYZING, AnalysisStatus.PARTIAL)
+
 def count_active_analyses(user_id: int, db: Session) -> int:
     return db.query(Analysis).filter(
         Analysis.user_id == user_id,
-        Analysis.status.in_([AnalysisStatus.QUEUED, AnalysisStatus.PROCESSING, AnalysisStatus.ANALYZING])
+        Analysis.status.in_(ACTIVE_STATUSES)
     ).count()
 
-def deduct_credits(user: User, amount: float, db: Session):
-    check_credits(user, amount)
-    user.credits -= amount
-    db.commit()
-    db.refresh(user)
-    print(f"Deducted {amount} credits from User {user.email}. New balance: {user.credits}")
+async def count_active_analyses_async(user_id: int, db: AsyncSession) -> int:
+    return await db.scalar(select(func.count(Analysis.id)).where(
+        Analysis.user_id == user_id,
+        Analysis.status.in_(ACTIVE_STATUSES)
+    ))
 
-@router.post("/upload", response_model=AnalysisOut)
-async def upload_video(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
+def check_can_start_analysis(user: User, db: Session):
     # Check Minimum Balance (assume worst case 2.0 initially or just allow check inside)
     # We don't know duration yet, but max cost is 2.0. Min is 1.0.
     # Let's verify user has at least 1.0 credit before uploading to save bandwidth.
-    check_credits(current_user, 1.0) 
+    check_credits(user, 1.0) 
 
     # Check Concurrency
-    active_jobs = count_active_analyses(current_user.id, db)
+    active_jobs = count_active_analyses(user.id, db)
     if active_jobs >= 2:
         raise HTTPException(status_code=429, detail="Too many active analyses. Please wait for current jobs to finish.") 
 
-    user_id = current_user.id
-    
-    try:
-        # Save file
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+def early_upload_check(user: User):
+    """
+    on_probe callback for storage writers: runs as soon as the container
+    headers have been written, before the rest of the file is. For raw and
+    resumable uploads that is also before the rest of the file arrives.
+    """
+    def reject_early(media: dict):
+        duration = media.get("duration") or 0
+        if duration > MAX_DURATION_SECONDS:
+            raise HTTPException(status_code=400, detail="Video exceeds the 25-minute limit.")
+        check_credits(user, cost_for_duration(duration))
+    return reject_early
 
-        # Check duration
-        duration = 0
+def upload_duration(stored: dict) -> float:
+    """
+    Duration of a stored upload (container headers only, no decoding). Over
+    the limit, a blob this upload created is removed and 400 raised. Blocking
+    (may run ffprobe, removes files): keep it off the event loop.
+    """
+    media = stored["media"]
+    if media is None:
         try:
-            from moviepy.editor import VideoFileClip
-            clip = VideoFileClip(file_path)
-            duration = clip.duration
-            clip.close()
-            
-            if duration > 1500: # 25 minutes * 60 seconds
-                os.remove(file_path)
-                raise HTTPException(status_code=400, detail="Video exceeds the 25-minute limit.")
-        except ImportError:
-            print("moviepy not installed, skipping duration check")
+            media = probe_media(stored["path"])
         except Exception as e:
             print(f"Error checking duration: {e}")
-            
-        # Determing Cost
-        # 1 Credit = Up to 2 minutes (120 seconds)
-        cost = 2.0 if duration > 120 else 1.0
-        
-        # Deduct Credits
-        deduct_credits(current_user, cost, db)
-            
-        # Create Video record
-        video = Video(
-            user_id=user_id,
-            source_type="upload",
-            title=file.filename, # Save original filename as title
-            storage_path=file_path,
-            platform_guess="Unknown",
-            duration=duration
-        )
-        db.add(video)
-        db.commit()
-        db.refresh(video)
-        
-        # Create Analysis record
-        analysis = Analysis(
-            user_id=user_id,
-            video_id=video.id,
-            status=AnalysisStatus.QUEUED
-        )
-        db.add(analysis)
-        db.commit()
-        db.refresh(analysis)
-        
-        # Trigger background processing
-        background_tasks.add_task(process_analysis, analysis.id, file_path)
+            media = {}
+    duration = media.get("duration") or 0
+
+    if duration > MAX_DURATION_SECONDS:
+        if stored["created"]:
+            os.remove(stored["path"])
+        raise HTTPException(status_code=400, detail="Video exceeds the 25-minute limit.")
+    return duration
+
+def create_upload_analysis(db: Session, current_user: User, filename: str, stored: dict, duration: float = None) -> Analysis:
+    """
+    Charges for a stored upload and creates its Video/Analysis records, reusing
+    a previous result for identical bytes or queueing a worker job. Pass
+    `duration` from upload_duration to keep file work out of this call.
+    """
+    user_id = current_user.id
+    file_path = stored["path"]
+
+    if duration is None:
+        duration = upload_duration(stored)
+
+    # Determing Cost
+    cost = cost_for_duration(duration)
+    check_credits(current_user, cost)
         
-        print(f"Upload successful. Created Analysis ID: {analysis.id} for User ID: {user_id}")
-        return analysis
+    # Create Video record
+    video = Video(
+        user_id=user_id,
+        source_type="upload",
+        title=filename, # Save original filename as title
+        storage_path=file_path,
+        content_hash=stored["sha256"],
+        platform_guess="Unknown",
+        duration=duration
+    )
+    db.add(video)
+    db.flush()
+    
+    # Same bytes already analyzed for the same platform/category? Reuse it.
+    context = build_context(video.platform_guess, current_user)
+    previous = find_reusable_analysis(db, stored["sha256"], context)
+
+    # Create Analysis record
+    analysis = Analysis(
+        user_id=user_id,
+        video_id=video.id,
+        status=AnalysisStatus.QUEUED
+    )
+    if previous:
+        copy_result(previous, analysis)
+    db.add(analysis)
+    db.flush()
+
+    # Charge atomically against the current balance; the records only commit if it succeeds
+    try:
+        balance = debit_credits(db, user_id, cost, analysis_id=analysis.id, reason="upload")
+    except InsufficientCredits:
+        db.rollback()
+        raise HTTPException(status_code=402, detail="Insufficient credits")
+    db.commit()
+    db.refresh(analysis)
+    print(f"Deducted {cost} credits from User {current_user.email}. New balance: {balance}")
+    
+    if previous:
+        print(f"Reused Analysis ID {previous.id} for identical upload (sha256 {stored['sha256'][:12]})")
+    else:
+        # Hand off to the worker processes
+        enqueue_job(db, JOB_ANALYSIS, {"analysis_id": analysis.id, "video_path": file_path})
+    
+    print(f"Upload successful. Created Analysis ID: {analysis.id} for User ID: {user_id}")
+    return analysis
+
+@router.post("/upload", response_model=AnalysisOut)
+async def upload_video(
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    """
+    Multipart upload. The whole body has been received (and spooled by the
+    framework) before this runs, so a too long or too expensive video is only
+    rejected while it is copied into storage: nothing is kept, but the
+    transfer already happened. /upload/stream cuts the transfer itself off.
+    """
+    await db.run_sync(lambda session: check_can_start_analysis(current_user, session))
+
+    try:
+        # Save file through UploadWriter (content-addressed, hashed and probed while copying)
+        stored = await run_in_threadpool(save_upload, file.file, file.filename, on_probe=early_upload_check(current_user))
+        duration = await run_in_threadpool(upload_duration, stored)
+        # run_sync runs on the event loop: database work only from here on
+        return await db.run_sync(lambda session: create_upload_analysis(session, current_user, file.filename, stored, duration))
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Upload failed with error: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-def process_link_import(analysis_id: int, video_id: int, url: str):
+@router.post("/upload/stream", response_model=AnalysisOut)
+async def upload_video_stream(
+    request: Request,
+    filename: str = "upload.mp4",
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
     """
-    Background task to download video and then trigger analysis.
+    Raw upload: the request body is the video itself (no multipart), e.g.
+    `POST /api/videos/upload/stream?filename=clip.mp4`.
+
+    Chunks go straight from the socket to their final storage path, hashed and
+    probed inline, with disk and DB work kept off the event loop. The transfer
+    is cut off as soon as the headers show the video is too long or too
+    expensive.
     """
-    db = SessionLocal()
+    await run_in_threadpool(check_can_start_analysis, current_user, db)
+
+    filename = os.path.basename(filename) or "upload.mp4"
+    writer = await run_in_threadpool(UploadWriter, filename, early_upload_check(current_user))
     try:
-        print(f"Starting background download for Analysis {analysis_id}, URL: {url}")
-        
-        # Update status to PROCESSING (covers downloading)
-        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
-        if analysis:
-            analysis.status = AnalysisStatus.PROCESSING
-            db.commit()
-
-        # Download
-        info = download_video(url)
-        duration = info.get('duration', 0)
-        
-        # Determing Cost
-        # 1 Credit = Up to 2 minutes (120 seconds)
-        cost = 2.0 if duration > 120 else 1.0
-        
-        # We need to deduct credits NOW. But we don't have the user object in this session easily unless we query.
-        # Also, what if they don't have credits? FAILED state?
-        user = db.query(User).filter(User.id == analysis.user_id).first()
-        if user.credits < cost:
-             print(f"Insufficient credits for background task. User has {user.credits}, needs {cost}")
-             analysis.status = AnalysisStatus.FAILED
-             # Optional: Add error message to insights?
-             db.commit()
-             return
-
-        # Deduct
-        user.credits -= cost
-        db.commit()
-        
-        # Update Video record
-        video = db.query(Video).filter(Video.id == video_id).first()
-        if video:
-            video.storage_path = info['path']
-            video.duration = duration
-            video.title = info['title'] # Save YouTube/TikTok title
-            video.platform_guess = info['platform']
-            db.commit()
-            
-            db.close()
-            
-            # Call process_analysis (it will open its own session)
-            process_analysis(analysis_id, info['path'])
-            return
+        pending = bytearray()
+        async for chunk in request.stream():
+            pending += chunk
+            if len(pending) >= STREAM_WRITE_BYTES:
+                await run_in_threadpool(writer.write, bytes(pending))
+                pending.clear()
+        if pending:
+            await run_in_threadpool(writer.write, bytes(pending))
+        stored = await run_in_threadpool(writer.finish)
+    except Exception as e:
+        await run_in_threadpool(writer.abort)
+        if isinstance(e, HTTPException):
+            raise
+        print(f"Streaming upload failed with error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
+    try:
+        return await run_in_threadpool(create_upload_analysis, db, current_user, filename, stored)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Link Import Failed: {e}")
-        db = SessionLocal()
-        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
-        if analysis:
-            analysis.status = AnalysisStatus.FAILED
-        db.commit()
-        db.close()
+        print(f"Upload failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/link", response_model=AnalysisOut)
 async def import_link(
     link_data: VideoCreate,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     # Check Minimum Balance
     check_credits(current_user, 1.0) # Ensure at least 1 credit to start
 
     # Check Concurrency
-    active_jobs = count_active_analyses(current_user.id, db)
+    active_jobs = await count_active_analyses_async(current_user.id, db)
     if active_jobs >= 2:
         raise HTTPException(status_code=429, detail="Too many active analyses. Please wait for current jobs to finish.")
 
@@ -262,8 +268,8 @@ async def import_link(
         # storage_path and duration will be filled later
     )
     db.add(video)
-    db.commit()
-    db.refresh(video)
+    await db.commit()
+    await db.refresh(video)
     
     # Create Analysis record
     analysis = Analysis(
@@ -272,11 +278,12 @@ async def import_link(
         status=AnalysisStatus.QUEUED
     )
     db.add(analysis)
-    db.commit()
-    db.refresh(analysis)
+    await db.commit()
+    await db.refresh(analysis)
     
-    # Trigger background processing
-    background_tasks.add_task(process_link_import, analysis.id, video.id, link_data.source_url)
+    # Hand off to the worker processes
+    payload = {"analysis_id": analysis.id, "video_id": video.id, "url": link_data.source_url}
+    await db.run_sync(lambda session: enqueue_job(session, JOB_LINK_IMPORT, payload))
     
     print(f"Link import queued. Analysis ID: {analysis.id}")
     return analysis
@@ -284,19 +291,12 @@ async def import_link(
 @router.post("/script", response_model=AnalysisOut)
 async def analyze_script(
     script_data: ScriptCreate,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
-    # Cost: 0.5 Credits
-    deduct_credits(current_user, 0.5, db)
-
-    # Check Concurrency
-    active_jobs = count_active_analyses(current_user.id, db)
+    # Check Concurrency (before charging anything)
+    active_jobs = await count_active_analyses_async(current_user.id, db)
     if active_jobs >= 2:
-        # Refund if rejected? 
-        # Actually logic is better: Check BEFORE deduct.
-        # But here logic is messy. Let's move check up.
         raise HTTPException(status_code=429, detail="Too many active analyses. Please wait for current jobs to finish.")
 
     user_id = current_user.id
@@ -310,8 +310,7 @@ async def analyze_script(
         # No storage path or duration for scripts
     )
     db.add(video)
-    db.commit()
-    db.refresh(video)
+    await db.flush()
     
     # Create Analysis record
     analysis = Analysis(
@@ -320,15 +319,68 @@ async def analyze_script(
         status=AnalysisStatus.QUEUED
     )
     db.add(analysis)
-    db.commit()
-    db.refresh(analysis)
+    await db.flush()
+
+    # Cost: 0.5 Credits, charged atomically together with the records above
+    try:
+        balance = await db.run_sync(lambda session: debit_credits(session, user_id, SCRIPT_COST, analysis_id=analysis.id, reason="script"))
+    except InsufficientCredits:
+        await db.rollback()
+        raise HTTPException(status_code=402, detail="Insufficient credits")
+    await db.commit()
+    await db.refresh(analysis)
+    print(f"Deducted {SCRIPT_COST} credits from User {current_user.email}. New balance: {balance}")
     
-    # Trigger background processing
+    # Hand off to the worker processes
     # We pass None as video_path since it's a script
-    background_tasks.add_task(process_analysis, analysis.id, None)
+    payload = {"analysis_id": analysis.id, "video_path": None}
+    await db.run_sync(lambda session: enqueue_job(session, JOB_ANALYSIS, payload))
     
     return analysis
 
+@router.get("/events")
+async def stream_user_events(request: Request, current_user: User = Depends(get_current_user_stream)):
+    """
+    Server-Sent Events for all of the user's analyses: a `status` event
+    {"analysis_id", "status", "section"?} per change, and `progress` events
+    {"analysis_id", "status", "progress": {"downloaded", "total"}} while a link
+    downloads. Fetch or subscribe to the analysis itself for the data. Needs
+    Postgres to see worker changes.
+    """
+    user_id = current_user.id
+
+    async def events():
+        async with broker.subscribe(user_topic(user_id)) as queue:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_message("progress" if "progress" in event else "status", json.dumps(event))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/history", response_model=List[AnalysisOut])
+def get_analysis_history(response: Response, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, since: Optional[datetime] = None,
+                         video_id: Optional[int] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    The user's analyses (optionally of one video), newest first, paginated
+    like the video list (cursor / X-Next-Cursor, since).
+    """
+    query = db.query(Analysis).options(joinedload(Analysis.video)).filter(Analysis.user_id == current_user.id)
+    if video_id is not None:
+        query = query.filter(Analysis.video_id == video_id)
+    try:
+        analyses = keyset_page(query, Analysis, cursor, since, limit).all()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cursor = next_cursor(analyses, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return [analysis_out(analysis) for analysis in analyses]
+
 @router.get("/{analysis_id}", response_model=AnalysisOut)
 def get_analysis(analysis_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     print(f"Get Analysis Request: ID={analysis_id}, User={current_user.id}")
@@ -340,6 +392,9 @@ def get_analysis(analysis_id: int, db: Session = Depends(get_db), current_user:
     if analysis.insights:
         print(f"Insights type: {type(analysis.insights)}")
     
+    return analysis_out(analysis)
+
+def analysis_out(analysis: Analysis) -> AnalysisOut:
     # Convert to Pydantic model to add extra fields
     # Note: Pydantic v2 uses model_validate, but we might be on v1 or v2 shim.
     # Let's try manual dict creation or just return the object if we didn't add video_url to Analysis model.
@@ -358,6 +413,65 @@ def get_analysis(analysis_id: int, db: Session = Depends(get_db), current_user:
         
     return analysis_data
 
+def _load_analysis_out(analysis_id: int, user_id: int):
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == analysis_id, Analysis.user_id == user_id).first()
+        return analysis_out(analysis) if analysis else None
+    finally:
+        db.close()
+
+def sse_message(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@router.get("/{analysis_id}/events")
+async def stream_analysis_events(analysis_id: int, request: Request, current_user: User = Depends(get_current_user_stream)):
+    """
+    Server-Sent Events for one analysis, instead of polling GET /{analysis_id}.
+    Sends an `analysis` event (same body as GET /{analysis_id}) right away and
+    again whenever the status or a partial result changes, plus `progress`
+    events ({"downloaded", "total"} bytes) while a link downloads; closes once
+    the analysis is completed or failed. Auth: Bearer header or `?token=`.
+    """
+    user_id = current_user.id
+    if await run_in_threadpool(_load_analysis_out, analysis_id, user_id) is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+
+    async def events():
+        # Subscribe before reading the current state so no change falls in between
+        async with broker.subscribe(analysis_topic(analysis_id)) as queue:
+            current = await run_in_threadpool(_load_analysis_out, analysis_id, user_id)
+            yield "retry: 3000\n\n"
+            yield sse_message("analysis", current.model_dump_json())
+            checked_at = time.monotonic()
+            while current.status not in FINAL_STATUSES and not await request.is_disconnected():
+                try:
+                    burst = [await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)]
+                except asyncio.TimeoutError:
+                    # Without NOTIFY, worker changes can't reach us: re-read now and then
+                    if uses_notify() or time.monotonic() - checked_at < SSE_RECHECK_SECONDS:
+                        yield ": keepalive\n\n"
+                        continue
+                    burst = []
+                while not queue.empty():
+                    burst.append(queue.get_nowait()) # a burst of events needs one read
+                progress = [event["progress"] for event in burst if "progress" in event]
+                if progress:
+                    yield sse_message("progress", json.dumps(progress[-1]))
+                    if len(progress) == len(burst):
+                        continue # nothing stored changed
+                latest = await run_in_threadpool(_load_analysis_out, analysis_id, user_id)
+                checked_at = time.monotonic()
+                if latest is None:
+                    break
+                if latest != current:
+                    current = latest
+                    yield sse_message("analysis", current.model_dump_json())
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.get("/{analysis_id}/report.pdf")
 def get_analysis_pdf(analysis_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     analysis = db.query(Analysis).filter(Analysis.id == analysis_id, Analysis.user_id == current_user.id).first()
@@ -407,6 +521,8 @@ def get_analysis_pdf(analysis_id: int, db: Session = Depends(get_db), current_us
     
     if analysis.subscores:
         for key, data in analysis.subscores.items():
+            if not isinstance(data, dict):
+                continue # stored as null by older results
             # Check if y is too low, new page
             if y < 100:
                 p.showPage()
@@ -496,25 +612,48 @@ def get_analysis_pdf(analysis_id: int, db: Session = Depends(get_db), current_us
     return Response(content=buffer.getvalue(), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=analysis_{analysis_id}.pdf"})
 
 @router.get("/", response_model=List[VideoOut])
-def get_videos(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def get_videos(response: Response, skip: int = 0, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, since: Optional[datetime] = None,
+               db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    The user's videos, newest first. For the next page pass the opaque cursor
+    from the X-Next-Cursor response header (absent on the last page); `since`
+    restricts the listing to videos created after it (incremental sync).
+    `skip` is still honoured for older clients.
+    """
     print(f"Fetching videos for user_id: {current_user.id}")
-    videos = db.query(Video).filter(Video.user_id == current_user.id).order_by(Video.created_at.desc()).offset(skip).limit(limit).all()
-    print(f"Found {len(videos)} videos")
+    try:
+        page = keyset_page(db.query(Video.id).filter(Video.user_id == current_user.id), Video, cursor, since, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if skip and not cursor:
+        page = page.offset(skip)
+    page = page.subquery()
+    # One statement: the page of videos, each joined to its latest analysis
+    # (row_number over the page's analyses, served by ix_analyses_video_id_created_at)
+    ranked = db.query(
+        Analysis.id, Analysis.video_id, Analysis.status, Analysis.overall_score, Analysis.optimized_assets,
+        func.row_number().over(partition_by=Analysis.video_id, order_by=(Analysis.created_at.desc(), Analysis.id.desc())).label("rank"),
+    ).filter(Analysis.video_id.in_(select(page.c.id))).subquery()
+    rows = db.query(Video, ranked.c.id, ranked.c.status, ranked.c.overall_score, ranked.c.optimized_assets) \
+        .join(page, page.c.id == Video.id) \
+        .outerjoin(ranked, (ranked.c.video_id == Video.id) & (ranked.c.rank == 1)) \
+        .order_by(Video.created_at.desc(), Video.id.desc()).all()
+    print(f"Found {len(rows)} videos")
+    cursor = next_cursor(rows, limit, key=lambda row: row[0])
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
     
     results = []
-    for video in videos:
-        # Get latest analysis
-        analysis = db.query(Analysis).filter(Analysis.video_id == video.id).order_by(Analysis.created_at.desc()).first()
-        
+    for video, analysis_id, status, overall_score, optimized_assets in rows:
         video_data = VideoOut.model_validate(video)
-        if analysis:
-            video_data.viral_score = analysis.overall_score
-            video_data.status = analysis.status
-            video_data.analysis_id = analysis.id
+        if analysis_id is not None:
+            video_data.viral_score = overall_score
+            video_data.status = status
+            video_data.analysis_id = analysis_id
             
             # Smart Title Extraction
-            if analysis.optimized_assets and analysis.optimized_assets.get('titles'):
-                titles = analysis.optimized_assets.get('titles')
+            if optimized_assets and optimized_assets.get('titles'):
+                titles = optimized_assets.get('titles')
                 if isinstance(titles, list) and len(titles) > 0:
                     video_data.title = titles[0]
             
@@ -539,19 +678,10 @@ def get_videos(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), c
 
 @router.get("/stats/overview")
 def get_video_stats(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    videos = db.query(Video).filter(Video.user_id == current_user.id).all()
-    total_videos = len(videos)
-    
-    total_score = 0
-    analyzed_count = 0
-    
-    for video in videos:
-        analysis = db.query(Analysis).filter(Analysis.video_id == video.id).order_by(Analysis.created_at.desc()).first()
-        if analysis and analysis.overall_score:
-            total_score += analysis.overall_score
-            analyzed_count += 1
-            
-    avg_score = round(total_score / analyzed_count) if analyzed_count > 0 else 0
+    # Maintained incrementally (services/user_stats.py): a single primary-key lookup
+    stats = stats_overview(db, current_user.id)
+    analyzed_count = stats["analyzed_count"]
+    avg_score = round(stats["score_sum"] / analyzed_count) if analyzed_count > 0 else 0
     
     # Determine growth potential based on avg score
     if avg_score >= 80:
@@ -562,7 +692,8 @@ def get_video_stats(db: Session = Depends(get_db), current_user: User = Depends(
         growth_potential = "Low"
         
     return {
-        "total_analyzed": total_videos,
+        "total_analyzed": stats["video_count"],
         "avg_score": avg_score,
-        "growth_potential": growth_potential
+        "growth_potential": growth_potential,
+        "score_histogram": stats["score_histogram"]
     }
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, BeforeValidator, EmailStr
+from typing import Annotated, Optional, List, Dict, Any
 from datetime import datetime
 from models import PlanType, AnalysisStatus
 
@@ -74,6 +74,20 @@ class VideoOut(VideoBase):
     class Config:
         from_attributes = True
 
+# Resumable Upload Schemas
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+
+class UploadSessionOut(BaseModel):
+    id: str
+    filename: str
+    size: int
+    offset: int # contiguous bytes received from the start
+    received: int # total bytes received, including out-of-order chunks
+    status: str
+    analysis_id: Optional[int] = None
+
 # Analysis Schemas
 class AnalysisBase(BaseModel):
     pass
@@ -113,3 +127,91 @@ class ReviewOut(ReviewBase):
 
     class Config:
         from_attributes = True
+
+# Gemini result shapes (see services/gemini_analyzer.py). Lenient on purpose:
+# a missing tip list shouldn't throw away an otherwise good analysis.
+def _round_score(value):
+    # JSON mode only guarantees valid JSON, not integers: 7.5 or "8" are
+    # common, and the int fields below would reject the whole analysis.
+    if isinstance(value, str):
+        try:
+            value = float(value.strip())
+        except ValueError:
+            return value
+    if isinstance(value, float):
+        return int(round(value))
+    return value
+
+Score = Annotated[int, BeforeValidator(_round_score)]
+
+class Subscore(BaseModel):
+    score: Optional[Score] = None
+    analysis: Optional[str] = None
+    tips: List[str] = []
+
+    class Config:
+        extra = "allow"
+
+class VideoSubscores(BaseModel):
+    hook: Subscore
+    delivery: Optional[Subscore] = None
+    structure: Optional[Subscore] = None
+    visuals_and_editing: Optional[Subscore] = None
+    trend_alignment: Optional[Subscore] = None
+
+    class Config:
+        extra = "allow"
+
+class ScriptSubscores(BaseModel):
+    hook: Subscore
+    story_arc: Optional[Subscore] = None
+    clarity: Optional[Subscore] = None
+    emotion: Optional[Subscore] = None
+    cta: Optional[Subscore] = None
+
+    class Config:
+        extra = "allow"
+
+class Insights(BaseModel):
+    executive_summary: Optional[str] = None
+    strengths: List[str] = []
+    weaknesses: List[str] = []
+    audience_retention_prediction: Optional[str] = None
+    emotional_impact: Optional[str] = None
+
+    class Config:
+        extra = "allow"
+
+class OptimizedAssets(BaseModel):
+    titles: List[str] = []
+    improved_hook: List[str] = []
+    script_rewrite_start: Optional[str] = None
+    full_script_rewrite: Optional[str] = None # scripts only
+    caption_suggestion: Optional[str] = None
+    hashtags: List[str] = []
+
+    class Config:
+        extra = "allow"
+
+class Checklist(BaseModel):
+    next_steps: List[str] = []
+
+    class Config:
+        extra = "allow"
+
+class VideoAnalysisResult(BaseModel):
+    overall_score: Score
+    subscores: VideoSubscores
+    insights: Optional[Insights] = None
+    optimized_assets: Optional[OptimizedAssets] = None
+    checklist: Optional[Checklist] = None
+
+class ScriptAnalysisResult(BaseModel):
+    overall_score: Score
+    subscores: ScriptSubscores
+    insights: Optional[Insights] = None
+    optimized_assets: Optional[OptimizedAssets] = None
+    checklist: Optional[Checklist] = None
+
+class HookResult(Subscore):
+    score: Score
@@ -0,0 +1,56 @@
+from datetime import datetime
+from sqlalchemy.orm import Session
+from models import Analysis, Video, AnalysisStatus
+
+RESULT_FIELDS = ("overall_score", "subscores", "insights", "optimized_assets", "checklist")
+
+def build_context(platform: str, user) -> dict:
+    """
+    Platform/category context sent to Gemini. Results are only reusable
+    between analyses with the same context.
+    """
+    return {
+        "platform": platform or "Unknown",
+        "category": user.primary_category if user else "General"
+    }
+
+def context_key(context: dict) -> str:
+    return f"{context.get('platform') or 'Unknown'}|{context.get('category') or 'General'}".lower()
+
+def find_reusable_analysis(db: Session, content_hash: str, context: dict, since: datetime = None):
+    """
+    Latest COMPLETED analysis of the same bytes under the same context, if any
+    (created after `since`, if given).
+    """
+    if not content_hash:
+        return None
+    query = db.query(Analysis).join(Video, Analysis.video_id == Video.id).filter(
+        Video.content_hash == content_hash,
+        Analysis.context_key == context_key(context),
+        Analysis.status == AnalysisStatus.COMPLETED,
+        Analysis.overall_score.isnot(None),
+    )
+    if since is not None:
+        query = query.filter(Analysis.created_at >= since)
+    return query.order_by(Analysis.created_at.desc()).first()
+
+def find_inflight_analysis(db: Session, content_hash: str, context: dict, before_id: int):
+    """
+    Oldest analysis of the same bytes under the same context that is still
+    running and was started before `before_id`. Only older analyses count, so
+    two concurrent ones never wait for each other.
+    """
+    if not content_hash:
+        return None
+    return db.query(Analysis).join(Video, Analysis.video_id == Video.id).filter(
+        Video.content_hash == content_hash,
+        Analysis.context_key == context_key(context),
+        Analysis.status.in_([AnalysisStatus.PROCESSING, AnalysisStatus.ANALYZING, AnalysisStatus.PARTIAL]),
+        Analysis.id < before_id,
+    ).order_by(Analysis.id).first()
+
+def copy_result(source: Analysis, target: Analysis):
+    for field in RESULT_FIELDS:
+        setattr(target, field, getattr(source, field))
+    target.context_key = source.context_key
+    target.status = AnalysisStatus.COMPLETED
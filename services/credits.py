@@ -0,0 +1,154 @@
+from sqlalchemy import event, exists, func, inspect, literal, select
+from sqlalchemy.orm import Session
+from models import Analysis, AnalysisStatus, CreditLedger, User
+from services import metrics
+
+# Pricing rules shared by the API and the worker pipeline
+
+MAX_DURATION_SECONDS = 1500 # 25 minutes * 60 seconds
+SCRIPT_COST = 0.5
+
+def cost_for_duration(duration: float) -> float:
+    # 1 Credit = Up to 2 minutes (120 seconds)
+    return 2.0 if (duration or 0) > 120 else 1.0
+
+# --- Ledger -------------------------------------------------------------------
+# Balances only change here. Each change is a single conditional
+# UPDATE users ... RETURNING credits (no read-modify-write, no row locks held
+# across requests) plus an append-only credit_ledger row, both in the
+# caller's transaction: callers commit.
+
+users = User.__table__
+ledger = CreditLedger.__table__
+
+# Balances are floats (0.5 credit scripts); differences below this are rounding
+DRIFT_TOLERANCE = 1e-6
+
+class InsufficientCredits(ValueError):
+    pass
+
+def _debit_key(analysis_id: int) -> str:
+    return f"analysis:{analysis_id}:debit"
+
+def _refund_key(analysis_id: int) -> str:
+    return f"analysis:{analysis_id}:refund"
+
+def _recorded(key: str):
+    return exists().where(ledger.c.idempotency_key == key)
+
+def _change(connection, user_id: int, amount: float, kind: str, key: str = None,
+            analysis_id: int = None, reason: str = None, require_funds: bool = False):
+    """
+    Adds `amount` (negative to charge) to the user's balance and records it.
+    Returns the new balance, or None if nothing changed: `key` was already
+    recorded, or (with require_funds) the balance is too low.
+    """
+    conditions = [users.c.id == user_id]
+    if require_funds:
+        conditions.append(users.c.credits >= -amount)
+    if key:
+        conditions.append(~_recorded(key))
+    balance = connection.execute(
+        users.update().where(*conditions).values(credits=users.c.credits + amount).returning(users.c.credits)
+    ).scalar()
+    if balance is None:
+        return None
+    connection.execute(ledger.insert().values(
+        user_id=user_id, analysis_id=analysis_id, kind=kind, amount=amount,
+        balance_after=balance, idempotency_key=key, reason=reason,
+    ))
+    return balance
+
+def debit_credits(db: Session, user_id: int, amount: float, analysis_id: int = None, reason: str = None) -> float:
+    """
+    Charges `amount` credits and returns the new balance. Charging the same
+    analysis again is a no-op. Raises InsufficientCredits.
+    """
+    connection = db.connection()
+    key = _debit_key(analysis_id) if analysis_id else None
+    balance = _change(connection, user_id, -amount, "debit", key, analysis_id, reason, require_funds=True)
+    if balance is not None:
+        return balance
+    if key and connection.execute(select(_recorded(key))).scalar():
+        return connection.execute(select(users.c.credits).where(users.c.id == user_id)).scalar()
+    raise InsufficientCredits(f"Insufficient credits, needs {amount}")
+
+def grant_credits(db: Session, user_id: int, amount: float, kind: str = "purchase", key: str = None, reason: str = None):
+    """
+    Adds credits (purchases, manual grants). Returns the new balance, or None
+    if `key` (e.g. a payment id) was already granted.
+    """
+    return _change(db.connection(), user_id, amount, kind, key, reason=reason)
+
+def _refund_analysis(connection, analysis_id: int):
+    debit = connection.execute(
+        select(ledger.c.user_id, ledger.c.amount).where(ledger.c.idempotency_key == _debit_key(analysis_id))
+    ).first()
+    if debit is None:
+        return None
+    return _change(connection, debit.user_id, -debit.amount, "refund", _refund_key(analysis_id), analysis_id, "analysis failed")
+
+def refund_analysis(db: Session, analysis_id: int):
+    """Gives back what the analysis was charged (once). Returns the new balance, or None."""
+    return _refund_analysis(db.connection(), analysis_id)
+
+@event.listens_for(Analysis, "after_update")
+def _refund_failed_analysis(mapper, connection, target):
+    # Automatic refunds: in the same transaction that marks the analysis FAILED
+    if AnalysisStatus.FAILED in inspect(target).attrs.status.history.added:
+        balance = _refund_analysis(connection, target.id)
+        if balance is not None:
+            print(f"Refunded the charge for failed Analysis {target.id}. New balance: {balance}")
+
+@event.listens_for(User, "after_insert")
+def _open_account(mapper, connection, target):
+    # Sign-up credits are the first ledger entry
+    connection.execute(ledger.insert().from_select(
+        ["user_id", "kind", "amount", "balance_after", "idempotency_key"],
+        select(users.c.id, literal("opening"), func.coalesce(users.c.credits, 0), users.c.credits, literal(f"user:{target.id}:opening"))
+        .where(users.c.id == target.id),
+    ))
+
+def reconcile_credits(db: Session) -> dict:
+    """
+    Janitor: refunds charges of FAILED analyses that were missed (e.g. marked
+    failed by a bulk UPDATE), then records any difference between
+    users.credits and the ledger sum as an entry, so the ledger explains
+    every balance ("opening" for users from before the ledger, "adjustment"
+    for direct edits such as the admin). Returns counts of both.
+    """
+    analyses = Analysis.__table__
+    refunds = ledger.alias("refunds")
+    missed = db.execute(
+        select(ledger.c.analysis_id)
+        .join(analyses, analyses.c.id == ledger.c.analysis_id)
+        .where(ledger.c.kind == "debit", analyses.c.status == AnalysisStatus.FAILED)
+        .where(~exists().where(refunds.c.analysis_id == ledger.c.analysis_id, refunds.c.kind == "refund"))
+    ).scalars().all()
+    refunded = 0
+    for analysis_id in missed:
+        if refund_analysis(db, analysis_id) is not None:
+            refunded += 1
+        db.commit()
+
+    totals = db.execute(
+        select(users.c.id, func.coalesce(users.c.credits, 0), func.coalesce(func.sum(ledger.c.amount), 0), func.count(ledger.c.id))
+        .select_from(users.outerjoin(ledger, ledger.c.user_id == users.c.id))
+        .group_by(users.c.id, users.c.credits)
+    ).all()
+    adjusted = 0
+    for user_id, balance, total, entries in totals:
+        drift = balance - total
+        if abs(drift) <= DRIFT_TOLERANCE:
+            continue
+        kind = "opening" if entries == 0 else "adjustment"
+        if kind == "adjustment":
+            print(f"Credit drift for User {user_id}: balance {balance}, ledger {total}")
+        db.execute(ledger.insert().values(user_id=user_id, kind=kind, amount=drift, balance_after=balance, reason="reconciliation"))
+        adjusted += 1
+    db.commit()
+    if refunded:
+        metrics.increment("credits.refunds_reconciled", refunded)
+    if adjusted:
+        metrics.increment("credits.adjustments", adjusted)
+    return {"refunded": refunded, "adjusted": adjusted}
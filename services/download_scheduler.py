@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+# Per-domain politeness: steady request rate (per second), burst size and how
+# many requests may be in flight at once. Limits apply per worker process.
+DOMAIN_LIMITS = {
+    "instagram.com": {"rate": 0.2, "burst": 3, "concurrency": 2},
+    "tiktok.com": {"rate": 0.5, "burst": 5, "concurrency": 4},
+    "youtube.com": {"rate": 1.0, "burst": 10, "concurrency": 4},
+}
+DEFAULT_LIMIT = {"rate": 1.0, "burst": 5, "concurrency": 4}
+# Limits are per site, shared by all worker processes: each one gets 1/DOWNLOAD_RATE_SHARE
+
+# Optional JSON override, e.g. '{"instagram.com": {"rate": 0.1, "burst": 2, "concurrency": 1}}'
+DOMAIN_LIMITS.update(json.loads(os.getenv("DOWNLOAD_DOMAIN_LIMITS", "{}")))
+
+DOMAIN_ALIASES = {
+    "youtu.be": "youtube.com",
+    "instagr.am": "instagram.com",
+}
+
+# Backoff after a 429 / block: doubles per hit, halves per success
+BACKOFF_MIN_SECONDS = float(os.getenv("DOWNLOAD_BACKOFF_MIN", "5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("DOWNLOAD_BACKOFF_MAX", "300"))
+THROTTLE_RETRIES = int(os.getenv("DOWNLOAD_THROTTLE_RETRIES", "2"))
+
+# HTTP statuses that mean "slow down"; without a status (extractor errors
+# that only carry a message) these phrases do
+THROTTLE_STATUSES = (429,)
+THROTTLE_MARKERS = (
+    "too many requests", "rate-limit", "rate limit", "rate-limited",
+    "please wait a few minutes", "temporarily blocked",
+)
+# Private / members-only posts: retrying (or slowing down the domain) won't help
+LOGIN_MARKERS = ("login required",)
+
+def http_status(error: Exception):
+    """
+    HTTP status behind a yt-dlp error, if there is one: DownloadError wraps the
+    original exception in exc_info, ExtractorError in cause.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = getattr(error, "status", None) or getattr(error, "code", None)
+        if isinstance(status, int):
+            return status
+        exc_info = getattr(error, "exc_info", None)
+        error = getattr(error, "cause", None) or (exc_info[1] if exc_info else None) or error.__cause__
+    return None
+
+def is_throttle_error(error: Exception) -> bool:
+    status = http_status(error)
+    if status is not None:
+        return status in THROTTLE_STATUSES
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+def is_login_error(error: Exception) -> bool:
+    # Instagram also answers "login required" when it is rate limiting, but then says so
+    message = str(error).lower()
+    return any(marker in message for marker in LOGIN_MARKERS) and not is_throttle_error(error)
+
+def _rate_share() -> int:
+    # Read lazily: worker.py sets it for its child processes
+    return max(1, int(os.getenv("DOWNLOAD_RATE_SHARE", "1")))
+
+def domain_for(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    for domain in list(DOMAIN_LIMITS) + list(DOMAIN_ALIASES):
+        if host == domain or host.endswith("." + domain):
+            return DOMAIN_ALIASES.get(domain, domain)
+    return host[4:] if host.startswith("www.") else host
+
+class DomainLimiter:
+    """
+    Token bucket plus concurrency cap for one domain. An idle domain has a
+    full bucket, so requests after a quiet period start immediately; bursts
+    drain it and are then spaced at `rate`.
+    """
+    def __init__(self, rate: float, burst: int, concurrency: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.lock = asyncio.Lock()
+        self.penalty = 0.0
+        self.blocked_until = 0.0
+
+    async def acquire(self):
+        await self.slots.acquire()
+        try:
+            async with self.lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.blocked_until:
+                        await asyncio.sleep(self.blocked_until - now)
+                        continue
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, throttled: bool = False):
+        self.slots.release()
+        if throttled:
+            self.penalty = min(max(self.penalty * 2, BACKOFF_MIN_SECONDS), BACKOFF_MAX_SECONDS)
+            # Jitter so parallel workers don't all come back at the same moment
+            self.blocked_until = time.monotonic() + self.penalty * random.uniform(0.8, 1.2)
+            self.tokens = 0
+        elif self.penalty:
+            self.penalty = self.penalty / 2 if self.penalty / 2 >= BACKOFF_MIN_SECONDS else 0.0
+
+class DownloadScheduler:
+    """
+    Shared gate in front of every yt-dlp request of a worker process.
+    """
+    def __init__(self):
+        self.limiters = {}
+
+    def limiter(self, url: str) -> DomainLimiter:
+        domain = domain_for(url)
+        if domain not in self.limiters:
+            limit = DOMAIN_LIMITS.get(domain, DEFAULT_LIMIT)
+            share = _rate_share()
+            self.limiters[domain] = DomainLimiter(
+                limit["rate"] / share,
+                max(1, limit["burst"] // share),
+                max(1, limit["concurrency"] // share),
+            )
+        return self.limiters[domain]
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        limiter = self.limiter(url)
+        await limiter.acquire()
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            raise
+        finally:
+            limiter.release(throttled)
+
+    async def run(self, url: str, func, *args):
+        """
+        Runs the blocking yt-dlp call `func(*args)` in a thread once the
+        domain allows it. Throttling errors are retried after the backoff;
+        a login wall fails right away with ValueError.
+        """
+        for attempt in range(THROTTLE_RETRIES + 1):
+            try:
+                async with self.slot(url):
+                    return await asyncio.to_thread(func, *args)
+            except Exception as e:
+                if is_login_error(e):
+                    raise ValueError(f"This video requires a login and can't be imported: {e}")
+                if attempt == THROTTLE_RETRIES or not is_throttle_error(e):
+                    raise
+                print(f"{domain_for(url)} is throttling us, retrying after backoff ({attempt + 1}/{THROTTLE_RETRIES})")
+
+_scheduler = None
+
+def get_download_scheduler() -> DownloadScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = DownloadScheduler()
+    return _scheduler
@@ -0,0 +1,140 @@
+"""
+Analysis status events for push clients (see the SSE endpoints in routers/videos.py).
+
+Events are published where analyses change (mostly in the worker) and fanned
+out to subscribers by an in-process broker. With Postgres, publishing goes
+through NOTIFY on the writer's own transaction, so it is delivered only once
+the change is committed; each API process LISTENs and feeds its local broker.
+Without Postgres (local dev) events only reach subscribers in the same process.
+"""
+import asyncio
+import json
+import select
+import threading
+import time
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from database import engine
+
+NOTIFY_CHANNEL = "analysis_events"
+
+def analysis_topic(analysis_id: int) -> str:
+    return f"analysis:{analysis_id}"
+
+def user_topic(user_id: int) -> str:
+    return f"user:{user_id}"
+
+class LocalBroker:
+    """
+    In-process pub/sub keyed by topic. Subscribers get an asyncio.Queue;
+    publish() may be called from any thread.
+    """
+    def __init__(self):
+        self.subscribers = {} # topic -> set of (loop, queue)
+        self.lock = threading.Lock()
+
+    @asynccontextmanager
+    async def subscribe(self, topic: str, maxsize: int = 100):
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=maxsize))
+        with self.lock:
+            self.subscribers.setdefault(topic, set()).add(entry)
+        try:
+            yield entry[1]
+        finally:
+            with self.lock:
+                self.subscribers[topic].discard(entry)
+                if not self.subscribers[topic]:
+                    del self.subscribers[topic]
+
+    def publish(self, topic: str, event: dict):
+        with self.lock:
+            targets = list(self.subscribers.get(topic, ()))
+        for loop, queue in targets:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, event: dict):
+        if queue.full():
+            queue.get_nowait() # slow consumer: drop the oldest, the latest state matters
+        queue.put_nowait(event)
+
+broker = LocalBroker()
+
+def uses_notify() -> bool:
+    return engine.dialect.name == "postgresql"
+
+def _deliver(event: dict):
+    broker.publish(analysis_topic(event["analysis_id"]), event)
+    broker.publish(user_topic(event["user_id"]), event)
+
+def notify_analysis(db: Session, analysis, **extra):
+    """
+    Publishes the current state of `analysis`. Call it before db.commit():
+    with Postgres the event then goes out exactly when the change becomes
+    visible (and not at all if it is rolled back).
+    """
+    event = {"analysis_id": analysis.id, "user_id": analysis.user_id, "status": analysis.status.value, **extra}
+    if uses_notify():
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": json.dumps(event)})
+    else:
+        _deliver(event)
+
+def publish_progress(analysis_id: int, user_id: int, downloaded: int, total=None):
+    """
+    Publishes download progress of an analysis (a `progress` member instead of
+    a state change, nothing is stored). Callers throttle: on Postgres every
+    call is a NOTIFY on its own short transaction.
+    """
+    event = {
+        "analysis_id": analysis_id, "user_id": user_id, "status": "processing",
+        "progress": {"downloaded": downloaded, "total": total},
+    }
+    if uses_notify():
+        with engine.begin() as connection:
+            connection.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": json.dumps(event)})
+    else:
+        _deliver(event)
+
+def _listen_forever():
+    while True:
+        connection = None
+        try:
+            connection = engine.raw_connection()
+            connection.set_isolation_level(0) # autocommit, required for LISTEN
+            cursor = connection.cursor()
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            pg = connection.driver_connection
+            print(f"Listening for {NOTIFY_CHANNEL}")
+            while True:
+                if select.select([pg], [], [], 30) == ([], [], []):
+                    continue
+                pg.poll()
+                while pg.notifies:
+                    notification = pg.notifies.pop(0)
+                    try:
+                        _deliver(json.loads(notification.payload))
+                    except Exception as e:
+                        print(f"Bad {NOTIFY_CHANNEL} payload: {e}")
+        except Exception as e:
+            print(f"Event listener failed, reconnecting: {e}")
+            time.sleep(5)
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+_listener = None
+
+def start_event_listener():
+    """
+    Starts the Postgres LISTEN thread that feeds the local broker (once per
+    API process). No-op on other databases.
+    """
+    global _listener
+    if not uses_notify() or _listener is not None:
+        return
+    _listener = threading.Thread(target=_listen_forever, name="analysis-events", daemon=True)
+    _listener.start()
@@ -1,9 +1,15 @@
 import os
+import asyncio
 import google.generativeai as genai
 import json
 from dotenv import load_dotenv
 from pathlib import Path
 from google.api_core import exceptions
+from pydantic import ValidationError
+from schemas import VideoAnalysisResult, ScriptAnalysisResult, HookResult
+from services import metrics
+from services.gemini_files import display_name, find_remote_file, register_remote_file, remote_file_key
+from services.gemini_limiter import get_gemini_limiter, usage_tokens
 
 
 # Load .env from backend directory explicitly if needed, or rely on cwd
@@ -81,21 +87,44 @@ def clean_json_output(text: str):
         print(f"FINAL FAILED JSON RAW TEXT (First 500 chars): {text[:500]}")
         return None
 
-def analyze_video_content(video_path: str, audio_path: str, frames: list[str], context: dict) -> dict:
-    """
-    Analyzes video content using Gemini Pro Vision (or 1.5 Pro).
-    Returns a structured JSON response.
-    """
-    if not API_KEY:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+# Configure safety settings to avoid blocking "edgy" viral content
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"}
+]
+
+MODEL_NAME = 'gemini-2.5-flash'
 
-    print(f"Using API Key: {API_KEY[:5]}...")
-    model = genai.GenerativeModel('gemini-1.5-pro')
+def _clock(seconds: float) -> str:
+    seconds = int(seconds or 0)
+    return f"{seconds // 60}:{seconds % 60:02d}"
 
-    # Prepare the prompt
-    prompt = f"""
+def _segment_note(segment: dict) -> str:
+    if not segment:
+        return ""
+    note = (
+        f"\n    NOTE: This clip is part {segment['index'] + 1} of {segment['count']} of a longer video "
+        f"({_clock(segment['start'])}-{_clock(segment['start'] + segment['duration'])}). "
+        "Score and describe this part on its own; the parts are combined afterwards."
+    )
+    if segment['index'] > 0:
+        note += " The hook is judged on part 1 only: score \"hook\" for how well this part re-hooks viewers."
+    return note + "\n"
+
+# JSON mode: the model emits bare JSON (no fences or prose), parsed by parse_result
+JSON_OUTPUT = genai.GenerationConfig(response_mime_type="application/json")
+
+def build_video_prompt(context: dict, segment: dict = None) -> str:
+    """
+    Builds the full-video analysis prompt for the given platform/category context.
+    With `segment` ({'index', 'count', 'start', 'duration'}) the prompt asks
+    about one part of a long video.
+    """
+    return f"""
     You are an expert viral video consultant and algorithm analyst. Analyze this short-form video content (Shorts/Reels/TikTok) deeply.
-    
+    {_segment_note(segment)}
     Context:
     - Platform: {context.get('platform', 'Unknown')}
     - Category: {context.get('category', 'General')}
@@ -162,64 +191,67 @@ def analyze_video_content(video_path: str, audio_path: str, frames: list[str], c
     Return ONLY the JSON. Do not include markdown formatting like ```json.
     IMPORTANT: Ensure the JSON is valid. Escape backslashes properly (e.g., \\ for paths).
     """
-    
-    # Prepare content parts
-    print(f"Uploading file to Gemini: {video_path}")
-    video_file = genai.upload_file(video_path)
-    print(f"File uploaded: {video_file.name}, State: {video_file.state.name}")
-    
-    import time
-    while video_file.state.name == "PROCESSING":
-        print("Waiting for video processing...")
-        time.sleep(2)
-        video_file = genai.get_file(video_file.name)
-        
-    if video_file.state.name == "FAILED":
-        print(f"Video processing failed: {video_file.state.name}")
-        raise ValueError("Video processing failed by Gemini.")
 
-    print("Generating content...")
-    
-    # Configure safety settings to avoid blocking "edgy" viral content
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"}
-    ]
-    
+def _reusable_upload(video_path: str):
+    """
+    ACTIVE remote copy of this exact file from an earlier upload, if any
+    (see services/gemini_files.py).
+    """
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content([prompt, video_file], safety_settings=safety_settings)
-        print("Content generated successfully.")
-        
-        # Check if response was blocked
-        if response.prompt_feedback and response.prompt_feedback.block_reason:
-             print(f"BLOCKED BY SAFETY FILTERS: {response.prompt_feedback.block_reason}")
-             raise ValueError(f"Content blocked by safety filters: {response.prompt_feedback.block_reason}")
-             
+        remote = find_remote_file(remote_file_key(video_path))
     except Exception as e:
-        print(f"Gemini Generation Error: {e}")
-        raise e
-    
-    result = clean_json_output(response.text)
-    if result is None:
-        raise ValueError("Failed to parse Gemini response (returned None)")
-    return result
+        print(f"Gemini file registry lookup failed: {e}")
+        return None
+    if remote is not None:
+        print(f"Reusing Gemini file {remote.name} for {video_path}")
+    return remote
+
+def _register_upload(video_path: str, video_file):
+    try:
+        register_remote_file(remote_file_key(video_path), video_file)
+    except Exception as e:
+        print(f"Could not register Gemini file {video_file.name}: {e}")
 
-def analyze_script_content(script_text: str, context: dict) -> dict:
+def _check_blocked(response):
+    # Check if response was blocked
+    if response.prompt_feedback and response.prompt_feedback.block_reason:
+         print(f"BLOCKED BY SAFETY FILTERS: {response.prompt_feedback.block_reason}")
+         raise ValueError(f"Content blocked by safety filters: {response.prompt_feedback.block_reason}")
+
+def parse_result(text: str, model) -> dict:
     """
-    Analyzes script content using Gemini 1.5 Pro.
-    Returns a structured JSON response.
+    Parses a JSON-mode response straight into `model` (one pass, no regex).
+    Only if that fails are the clean_json_output heuristics tried; both paths
+    are counted in services.metrics (gemini_parse.*). Fields the model left
+    out are dropped rather than stored as null, so consumers see the same
+    shape as before (e.g. no "delivery": null subscore).
     """
-    if not API_KEY:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    try:
+        result = model.model_validate_json(text)
+        metrics.increment("gemini_parse.strict")
+        return result.model_dump(exclude_none=True)
+    except ValidationError as e:
+        print(f"Strict parse into {model.__name__} failed, repairing: {str(e)[:200]}")
 
-    print(f"Using API Key: {API_KEY[:5]}...")
-    model = genai.GenerativeModel('gemini-1.5-pro')
+    metrics.increment("gemini_parse.repair")
+    data = clean_json_output(text)
+    if data is None:
+        metrics.increment("gemini_parse.failed")
+        raise ValueError("Failed to parse Gemini response (returned None)")
+    try:
+        return model.model_validate(data).model_dump(exclude_none=True)
+    except ValidationError as e:
+        metrics.increment("gemini_parse.failed")
+        raise ValueError(f"Gemini response does not match {model.__name__}: {e}")
+
+def _parse_video_response(text: str) -> dict:
+    return parse_result(text, VideoAnalysisResult)
 
-    # Prepare the prompt
-    prompt = f"""
+def build_script_prompt(script_text: str, context: dict) -> str:
+    """
+    Builds the script analysis prompt for the given platform/category context.
+    """
+    return f"""
     You are a world-class viral script writer and creative director. You have written scripts that have generated millions of views on TikTok, Reels, and Shorts.
     Your goal is to take the user's script and turn it into a viral masterpiece.
     
@@ -294,27 +326,403 @@ def analyze_script_content(script_text: str, context: dict) -> dict:
     Return ONLY the JSON. Do not include markdown formatting like ```json.
     IMPORTANT: Ensure the JSON is valid. Escape backslashes properly (e.g., \\ for paths).
     """
-    
-    # Configure safety settings to avoid blocking "edgy" viral content
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"}
-    ]
+
+def _parse_script_response(text: str) -> dict:
+    # Debug Logging
+    print(f"Gemini Raw Response (First 200 chars): {text[:200]}")
 
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(prompt, safety_settings=safety_settings)
+        return parse_result(text, ScriptAnalysisResult)
+    except ValueError:
+        print(f"FULL FAILED RESPONSE TEXT: {text}") # Log full text for debugging
+        raise
+
+# --- asyncio path -----------------------------------------------------------
+# The only path: every generation is streamed (truncation guard) and goes
+# through the rate limiter. Generation goes through the SDK's native async
+# client, and waiting for uploaded files to leave PROCESSING is multiplexed
+# through a single poller instead of one sleeping thread per file.
+
+POLL_MIN_INTERVAL = float(os.getenv("GEMINI_POLL_MIN_INTERVAL", "1"))
+POLL_MAX_INTERVAL = float(os.getenv("GEMINI_POLL_MAX_INTERVAL", "10"))
+# Above this many pending files one list_files() call is cheaper than N get_file() calls
+POLL_LIST_THRESHOLD = int(os.getenv("GEMINI_POLL_LIST_THRESHOLD", "4"))
+
+class FileStatePoller:
+    """
+    Tracks every uploaded Gemini file that is still PROCESSING and resolves one
+    future per waiter when the file turns ACTIVE or FAILED.
+
+    A single coroutine does all the polling. The interval starts at
+    POLL_MIN_INTERVAL, grows while nothing changes and snaps back whenever a
+    file finishes or a new one is added.
+    """
+    def __init__(self):
+        self.pending = {} # file name -> [futures]
+        self._task = None
+        self._wakeup = asyncio.Event()
+
+    async def wait_until_ready(self, video_file):
+        if video_file.state.name != "PROCESSING":
+            return self._check_state(video_file)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(video_file.name, []).append(future)
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        return self._check_state(await future)
+
+    def _check_state(self, video_file):
+        if video_file.state.name == "FAILED":
+            print(f"Video processing failed: {video_file.state.name}")
+            raise ValueError("Video processing failed by Gemini.")
+        return video_file
+
+    def _fetch_states(self, names: list) -> dict:
+        if len(names) > POLL_LIST_THRESHOLD:
+            wanted = set(names)
+            return {f.name: f for f in genai.list_files() if f.name in wanted}
+        return {name: genai.get_file(name) for name in names}
+
+    async def _run(self):
+        interval = POLL_MIN_INTERVAL
+        while self.pending:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+                interval = POLL_MIN_INTERVAL
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                states = await asyncio.to_thread(self._fetch_states, list(self.pending))
+            except Exception as e:
+                print(f"Gemini file poll failed: {e}")
+                interval = min(interval * 2, POLL_MAX_INTERVAL)
+                continue
+
+            changed = False
+            for name, video_file in states.items():
+                if video_file.state.name == "PROCESSING":
+                    continue
+                for future in self.pending.pop(name, []):
+                    if not future.done():
+                        future.set_result(video_file)
+                changed = True
+
+            # Drop waiters that were cancelled while we polled
+            for name in list(self.pending):
+                self.pending[name] = [f for f in self.pending[name] if not f.done()]
+                if not self.pending[name]:
+                    del self.pending[name]
+
+            interval = POLL_MIN_INTERVAL if changed else min(interval * 1.5, POLL_MAX_INTERVAL)
+
+_file_poller = None
+
+def get_file_poller() -> FileStatePoller:
+    """
+    One poller per event loop (i.e. per worker process).
+    """
+    global _file_poller
+    if _file_poller is None:
+        _file_poller = FileStatePoller()
+    return _file_poller
+
+async def upload_video_file_async(video_path: str):
+    """
+    Uploads a video to the Gemini File API and waits until it is ACTIVE.
+    Returns the Gemini file handle. Files uploaded before (and not yet
+    expired) are reused instead. The upload itself runs in a thread; the
+    PROCESSING wait is handled by the shared FileStatePoller.
+    """
+    if not API_KEY:
+        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+
+    reused = await asyncio.to_thread(_reusable_upload, video_path)
+    if reused is not None:
+        return reused
+
+    print(f"Uploading file to Gemini: {video_path}")
+    video_file = await asyncio.to_thread(genai.upload_file, video_path, display_name=display_name(video_path))
+    print(f"File uploaded: {video_file.name}, State: {video_file.state.name}")
+    video_file = await get_file_poller().wait_until_ready(video_file)
+    await asyncio.to_thread(_register_upload, video_path, video_file)
+    return video_file
+
+class JsonSectionParser:
+    """
+    Incremental parser for a JSON object arriving in pieces. `feed` returns
+    the (key, value) pairs of the top-level members that were completed by
+    the new text, so e.g. "subscores" can be used while "checklist" is still
+    being generated. Anything before the opening brace (like a ```json fence)
+    is ignored.
+    """
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.member_start = None
+        self.sections = {}
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        completed = []
+        while self.pos < len(self.text):
+            ch = self.text[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.depth > 0:
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.member_start = self.pos + 1
+            elif ch in "}]" and self.depth > 0:
+                if self.depth == 1:
+                    self._complete(self.pos, completed)
+                self.depth -= 1
+            elif ch == "," and self.depth == 1:
+                self._complete(self.pos, completed)
+                self.member_start = self.pos + 1
+            self.pos += 1
+        return completed
+
+    def _complete(self, end: int, completed: list):
+        member = self.text[self.member_start:end].strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads("{" + member + "}", strict=False)
+        except json.JSONDecodeError:
+            return
+        for key, value in parsed.items():
+            self.sections[key] = value
+            completed.append((key, value))
+
+async def _generate_streamed(model, contents, on_section=None):
+    """
+    Streams a generation and feeds it through JsonSectionParser, awaiting
+    `on_section(key, value)` for every completed top-level section.
+    Returns (full text, sections). If the stream breaks off after
+    overall_score arrived, what was received is returned instead of raising
+    (_parse_streamed turns it into TruncatedGeneration).
+    Goes through the model's rate limiter; a throttled attempt is retried
+    from the start (already persisted sections are simply written again).
+    """
+    async def attempt():
+        response = await model.generate_content_async(contents, safety_settings=SAFETY_SETTINGS, generation_config=JSON_OUTPUT, stream=True)
+        parser = JsonSectionParser()
+        parts = []
+        try:
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue # chunk without text parts (e.g. the final safety/finish chunk)
+                parts.append(text)
+                for key, value in parser.feed(text):
+                    if on_section:
+                        await on_section(key, value)
+        except Exception as e:
+            if "overall_score" not in parser.sections:
+                raise
+            print(f"Gemini stream broke off ({e}), keeping {list(parser.sections)}")
+        _check_blocked(response)
+        return ("".join(parts), parser.sections), usage_tokens(response)
+
+    return await get_gemini_limiter(model.model_name.split("/")[-1]).run(contents, attempt)
+
+class TruncatedGeneration(Exception):
+    """
+    The stream broke off after overall_score. The sections that did arrive are
+    valid (and already shown as PARTIAL), but the result is incomplete: worth
+    another attempt, never a COMPLETED analysis.
+    """
+    def __init__(self, sections: dict):
+        super().__init__(f"Gemini response was truncated after {', '.join(sections)}")
+        self.sections = sections
+
+def _parse_streamed(text: str, sections: dict, parse, model) -> dict:
+    """
+    Parses a streamed response. If it is truncated, the sections received so
+    far are validated against `model`: TruncatedGeneration if they hold up,
+    ValueError if not.
+    """
+    try:
+        return parse(text)
+    except ValueError:
+        if "overall_score" not in sections:
+            raise
+    try:
+        partial = model.model_validate(sections).model_dump(exclude_none=True)
+    except ValidationError as e:
+        raise ValueError(f"Truncated Gemini response does not match {model.__name__}: {e}")
+    raise TruncatedGeneration(partial)
+
+async def generate_video_analysis_async(video_file, context: dict, segment: dict = None, on_section=None) -> dict:
+    """
+    Runs the analysis prompt against an already uploaded (ACTIVE) Gemini
+    file, streamed (see _generate_streamed for `on_section`). Pass `segment` to analyze one part
+    of a long video (see build_video_prompt, merge_segment_results).
+    """
+    if not API_KEY:
+        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+
+    prompt = build_video_prompt(context, segment)
+    print("Generating content...")
+
+    try:
+        model = genai.GenerativeModel(MODEL_NAME)
+        text, sections = await _generate_streamed(model, [prompt, video_file], on_section)
+        print("Content generated successfully.")
     except Exception as e:
         print(f"Gemini Generation Error: {e}")
         raise e
-    
-    # Debug Logging
-    print(f"Gemini Raw Response (First 200 chars): {response.text[:200]}")
 
-    result = clean_json_output(response.text)
-    if result is None:
-        print(f"FULL FAILED RESPONSE TEXT: {response.text}") # Log full text for debugging
-        raise ValueError("Failed to parse Gemini response (returned None)")
-    return result
+    return _parse_streamed(text, sections, _parse_video_response, VideoAnalysisResult)
+
+def build_hook_prompt(context: dict) -> str:
+    """
+    Small prompt for the opening seconds only, answered in the shape of
+    subscores.hook so it can be shown before the full analysis lands.
+    """
+    return f"""
+    You are an expert viral video consultant. This clip is the opening of a short-form video (Shorts/Reels/TikTok).
+    Judge ONLY the hook: does it stop the scroll in the first 3 seconds? (Visuals, Audio, Text)
+
+    Context:
+    - Platform: {context.get('platform', 'Unknown')}
+    - Category: {context.get('category', 'General')}
+
+    Respond in this strict JSON format:
+    {{
+        "score": <0-100>,
+        "analysis": "Short breakdown of the first 3 seconds.",
+        "tips": ["Specific, actionable improvement tip 1", "Tip 2"]
+    }}
+
+    Return ONLY the JSON. Do not include markdown formatting like ```json.
+    """
+
+async def generate_hook_analysis_async(video_file, context: dict) -> dict:
+    """
+    Preliminary hook score for an uploaded clip of a video's opening.
+    Returns {'score', 'analysis', 'tips'}.
+    """
+    if not API_KEY:
+        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+
+    try:
+        model = genai.GenerativeModel(MODEL_NAME)
+        contents = [build_hook_prompt(context), video_file]
+
+        async def attempt():
+            response = await model.generate_content_async(contents, safety_settings=SAFETY_SETTINGS, generation_config=JSON_OUTPUT)
+            return response, usage_tokens(response)
+
+        response = await get_gemini_limiter(MODEL_NAME).run(contents, attempt)
+        _check_blocked(response)
+    except Exception as e:
+        print(f"Gemini Hook Generation Error: {e}")
+        raise e
+
+    return parse_result(response.text, HookResult)
+
+def _unique(items, limit: int) -> list:
+    seen, out = set(), []
+    for item in items:
+        key = str(item).strip().lower()
+        if key and key not in seen:
+            seen.add(key)
+            out.append(item)
+    return out[:limit]
+
+def merge_segment_results(results: list[dict], segments: list[dict]) -> dict:
+    """
+    Reduces per-segment analyses into the normal single-video schema.
+
+    Scores are duration-weighted means, with the opening segment counted twice
+    (retention is decided there). The hook comes from the first segment only.
+    Texts are labelled by time range, lists are merged without duplicates, and
+    opening-specific assets (titles, hooks, rewrite) come from the first segment.
+    Raises ValueError if no segment has an overall score.
+    """
+    weights = [max(seg.get("duration") or 0, 1.0) for seg in segments]
+    weights[0] *= 2
+    labels = [f"[{_clock(seg['start'])}-{_clock(seg['start'] + seg['duration'])}]" for seg in segments]
+    first = results[0]
+
+    def weighted(values):
+        pairs = [(v, w) for v, w in zip(values, weights) if isinstance(v, (int, float))]
+        if not pairs:
+            return None
+        return round(sum(v * w for v, w in pairs) / sum(w for _, w in pairs))
+
+    def labelled(texts):
+        return " ".join(f"{label} {text}" for label, text in zip(labels, texts) if text)
+
+    subscores = {}
+    for name in (first.get("subscores") or {}):
+        if name == "hook":
+            subscores[name] = first["subscores"][name]
+            continue
+        parts = [(r.get("subscores") or {}).get(name) or {} for r in results]
+        subscores[name] = {
+            "score": weighted([p.get("score") for p in parts]),
+            "analysis": labelled([p.get("analysis") for p in parts]),
+            "tips": _unique([tip for p in parts for tip in p.get("tips") or []], 5),
+        }
+
+    insights = [r.get("insights") or {} for r in results]
+    assets = [r.get("optimized_assets") or {} for r in results]
+    checklists = [r.get("checklist") or {} for r in results]
+    overall_score = weighted([r.get("overall_score") for r in results])
+    if overall_score is None:
+        raise ValueError(f"None of the {len(results)} segment analyses has an overall_score")
+    return {
+        "overall_score": overall_score,
+        "subscores": subscores,
+        "insights": {
+            "executive_summary": labelled([i.get("executive_summary") for i in insights]),
+            "strengths": _unique([x for i in insights for x in i.get("strengths") or []], 5),
+            "weaknesses": _unique([x for i in insights for x in i.get("weaknesses") or []], 5),
+            "audience_retention_prediction": labelled([i.get("audience_retention_prediction") for i in insights]),
+            "emotional_impact": insights[0].get("emotional_impact"),
+        },
+        "optimized_assets": {
+            **assets[0],
+            "hashtags": _unique([x for a in assets for x in a.get("hashtags") or []], 10),
+        },
+        "checklist": {
+            "next_steps": _unique([x for c in checklists for x in c.get("next_steps") or []], 8),
+        },
+    }
+
+async def analyze_script_content_async(script_text: str, context: dict, on_section=None) -> dict:
+    """
+    Analyzes script content, streamed (see _generate_streamed for
+    `on_section`).
+    """
+    if not API_KEY:
+        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+
+    prompt = build_script_prompt(script_text, context)
+
+    try:
+        model = genai.GenerativeModel(MODEL_NAME)
+        text, sections = await _generate_streamed(model, prompt, on_section)
+    except Exception as e:
+        print(f"Gemini Generation Error: {e}")
+        raise e
+
+    return _parse_streamed(text, sections, _parse_script_response, ScriptAnalysisResult)
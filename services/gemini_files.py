@@ -0,0 +1,111 @@
+import hashlib
+import os
+from datetime import timedelta
+import google.generativeai as genai
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal, SQLALCHEMY_DATABASE_URL
+from models import GeminiFile
+from services.job_queue import utcnow
+from services.storage import UPLOAD_DIR
+
+# Gemini keeps uploaded files for 48 hours
+DEFAULT_TTL_HOURS = 47
+# Don't hand out a remote file that expires before a generation could finish with it
+REUSE_MARGIN_MINUTES = int(os.getenv("GEMINI_FILE_REUSE_MARGIN_MINUTES", "60"))
+# Remote files not in the registry are deleted once they are this old (uploads in
+# flight are registered as soon as they turn ACTIVE, well within this)
+ORPHAN_GRACE_MINUTES = int(os.getenv("GEMINI_FILE_ORPHAN_GRACE_MINUTES", "60"))
+# Deployments sharing an API key see each other's files. Ours are uploaded with
+# this display name prefix and the janitor only deletes those. The default is
+# one per database, which is where the registry lives.
+FILE_PREFIX = os.getenv("GEMINI_FILE_PREFIX") or f"viralradar-{hashlib.sha256(SQLALCHEMY_DATABASE_URL.encode()).hexdigest()[:8]}:"
+
+def remote_file_key(path: str) -> str:
+    """
+    Registry key for a local file. Stored files are content-addressed
+    (uploads/<sha256>.mp4, proxies/<sha256>-<rung>.mp4, ...), so their path
+    below uploads/ identifies the bytes.
+    """
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(UPLOAD_DIR))
+    return os.path.splitext(relative)[0].replace(os.sep, "/")
+
+def display_name(path: str) -> str:
+    """Display name to upload `path` with (see FILE_PREFIX)."""
+    return f"{FILE_PREFIX}{remote_file_key(path)}"
+
+def _aware(value):
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=utcnow().tzinfo) # SQLite drops the timezone
+    return value
+
+def find_remote_file(file_key: str):
+    """
+    Returns the ACTIVE Gemini file registered for `file_key`, or None. Stale
+    entries (expiring soon, failed or gone remotely) are dropped.
+    """
+    db = SessionLocal()
+    try:
+        entry = db.query(GeminiFile).filter(GeminiFile.file_key == file_key).first()
+        if not entry:
+            return None
+        if _aware(entry.expires_at) > utcnow() + timedelta(minutes=REUSE_MARGIN_MINUTES):
+            try:
+                remote = genai.get_file(entry.name)
+                if remote.state.name == "ACTIVE":
+                    entry.last_used_at = utcnow()
+                    db.commit()
+                    return remote
+            except Exception as e:
+                print(f"Registered Gemini file {entry.name} is unusable: {e}")
+        db.delete(entry)
+        db.commit()
+        return None
+    finally:
+        db.close()
+
+def register_remote_file(file_key: str, remote):
+    expires_at = getattr(remote, "expiration_time", None) or utcnow() + timedelta(hours=DEFAULT_TTL_HOURS)
+    db = SessionLocal()
+    try:
+        db.add(GeminiFile(file_key=file_key, name=remote.name, expires_at=expires_at, last_used_at=utcnow()))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Uploaded concurrently by someone else: the newest copy wins,
+            # the other one becomes an orphan for the janitor
+            db.rollback()
+            entry = db.query(GeminiFile).filter(GeminiFile.file_key == file_key).first()
+            entry.name = remote.name
+            entry.expires_at = expires_at
+            entry.last_used_at = utcnow()
+            db.commit()
+    finally:
+        db.close()
+
+def cleanup_remote_files(db: Session) -> int:
+    """
+    Janitor: forgets expired registry entries and deletes remote files of
+    this deployment (FILE_PREFIX) that are no longer registered (superseded or
+    never registered). Anything else is left to expire on Gemini's side.
+    Returns the number of remote files deleted.
+    """
+    now = utcnow()
+    db.query(GeminiFile).filter(GeminiFile.expires_at < now).delete(synchronize_session=False)
+    db.commit()
+
+    registered = {name for (name,) in db.query(GeminiFile.name).all()}
+    cutoff = now - timedelta(minutes=ORPHAN_GRACE_MINUTES)
+    deleted = 0
+    for remote in genai.list_files():
+        if not (getattr(remote, "display_name", None) or "").startswith(FILE_PREFIX):
+            continue
+        created = _aware(getattr(remote, "create_time", None))
+        if remote.name in registered or created is None or created > cutoff:
+            continue
+        try:
+            genai.delete_file(remote.name)
+            deleted += 1
+        except Exception as e:
+            print(f"Could not delete Gemini file {remote.name}: {e}")
+    return deleted
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+import random
+import time
+from google.api_core import exceptions
+from services import metrics
+
+# Project quota per model: requests and tokens per minute. The quota is shared
+# by all worker processes, each one gets 1/GEMINI_RATE_SHARE of it.
+MODEL_LIMITS = {
+    "gemini-2.5-flash": {"rpm": 1000, "tpm": 1_000_000},
+}
+DEFAULT_MODEL_LIMIT = {"rpm": 60, "tpm": 250_000}
+
+# Optional JSON override, e.g. '{"gemini-2.5-flash": {"rpm": 150, "tpm": 1000000}}'
+MODEL_LIMITS.update(json.loads(os.getenv("GEMINI_RATE_LIMITS", "{}")))
+
+# Retries of 429 / 503 with jittered exponential backoff
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE", "2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("GEMINI_BACKOFF_MAX", "60"))
+
+# Token estimates used to reserve quota before a call; corrected from the
+# response's usage metadata afterwards
+VIDEO_TOKENS_PER_SECOND = 300 # ~258 for frames + 32 for audio
+FILE_TOKEN_ESTIMATE = int(os.getenv("GEMINI_FILE_TOKEN_ESTIMATE", "20000"))
+OUTPUT_TOKEN_ESTIMATE = 2000
+
+RETRYABLE_ERRORS = (
+    exceptions.ResourceExhausted, # 429
+    exceptions.TooManyRequests,
+    exceptions.ServiceUnavailable, # 503
+)
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+def backoff_delay(attempt: int) -> float:
+    # "Full jitter": parallel callers hit by the same 429 spread out instead of retrying in lockstep
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def _rate_share() -> int:
+    # Read lazily: worker.py sets it for its child processes
+    return max(1, int(os.getenv("GEMINI_RATE_SHARE", "1")))
+
+def _file_tokens(part) -> int:
+    try:
+        duration = part.video_metadata.video_duration
+        seconds = duration.total_seconds() if hasattr(duration, "total_seconds") else duration.seconds
+        if seconds:
+            return int(seconds * VIDEO_TOKENS_PER_SECOND)
+    except Exception:
+        pass
+    return FILE_TOKEN_ESTIMATE
+
+def estimate_tokens(contents) -> int:
+    """
+    Rough token count of a generate_content request: ~4 characters per text
+    token, uploaded video files by duration, plus the expected output.
+    """
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    total = OUTPUT_TOKEN_ESTIMATE
+    for part in parts:
+        total += len(part) // 4 if isinstance(part, str) else _file_tokens(part)
+    return total
+
+def usage_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) or None
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+class ModelLimiter:
+    """
+    Requests/min and tokens/min buckets for one model. Callers are admitted
+    strictly in arrival order (asyncio.Lock is FIFO), so a large video request
+    at the head of the queue can't be starved by a stream of small ones. A
+    429 from the API pauses the whole queue, not just the caller that got it.
+    """
+    def __init__(self, model_name: str, rpm: float, tpm: float):
+        self.model_name = model_name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.blocked_until = 0.0
+
+    def _gauge(self):
+        metrics.set_gauge(f"gemini_limiter.{self.model_name}.queue_depth", self.waiting)
+
+    async def acquire(self, tokens: int):
+        tokens = min(tokens, self.tokens.capacity) # oversized requests would never fit otherwise
+        started = time.monotonic()
+        self.waiting += 1
+        self._gauge()
+        try:
+            async with self.lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.blocked_until:
+                        await asyncio.sleep(self.blocked_until - now)
+                        continue
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if wait <= 0:
+                        self.requests.level -= 1
+                        self.tokens.level -= tokens
+                        break
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+            self._gauge()
+        metrics.observe(f"gemini_limiter.{self.model_name}.wait_seconds", time.monotonic() - started)
+
+    def settle(self, reserved: int, used):
+        """Corrects the token bucket once the real usage of a call is known."""
+        if used:
+            self.tokens.level -= used - min(reserved, self.tokens.capacity)
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def run(self, contents, call):
+        """
+        Runs `call()` (an async callable returning (result, used tokens or
+        None)) once the quota allows it, retrying 429/503 with jittered
+        exponential backoff. Returns the result.
+        """
+        reserved = estimate_tokens(contents)
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            await self.acquire(reserved)
+            try:
+                result, used = await call()
+            except Exception as e:
+                if not is_retryable(e) or attempt == GEMINI_MAX_RETRIES:
+                    if is_retryable(e):
+                        metrics.increment(f"gemini_limiter.{self.model_name}.gave_up")
+                    raise
+                delay = backoff_delay(attempt)
+                metrics.increment(f"gemini_limiter.{self.model_name}.retries")
+                print(f"Gemini {self.model_name} returned {type(e).__name__}, retrying in {delay:.1f}s ({attempt + 1}/{GEMINI_MAX_RETRIES})")
+                if isinstance(e, (exceptions.ResourceExhausted, exceptions.TooManyRequests)):
+                    self.pause(delay)
+                await asyncio.sleep(delay)
+                continue
+            self.settle(reserved, used)
+            return result
+
+_limiters = {}
+
+def get_gemini_limiter(model_name: str) -> ModelLimiter:
+    if model_name not in _limiters:
+        limit = MODEL_LIMITS.get(model_name, DEFAULT_MODEL_LIMIT)
+        share = _rate_share()
+        _limiters[model_name] = ModelLimiter(model_name, limit["rpm"] / share, limit["tpm"] / share)
+    return _limiters[model_name]
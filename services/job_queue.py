@@ -0,0 +1,124 @@
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import Session
+from models import Job, JobStatus
+
+JOB_ANALYSIS = "analysis"
+JOB_LINK_IMPORT = "link_import"
+
+# How long a claimed job is owned by a worker without a heartbeat
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+RETRY_DELAY_SECONDS = int(os.getenv("JOB_RETRY_DELAY_SECONDS", "30"))
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def enqueue_job(db: Session, kind: str, payload: dict) -> Job:
+    """
+    Persists a job so any worker process can pick it up.
+    Commits immediately so the job survives an API restart.
+    """
+    job = Job(kind=kind, payload=payload, status=JobStatus.QUEUED, run_after=utcnow())
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    print(f"Enqueued {kind} job {job.id}: {payload}")
+    return job
+
+def claim_job(db: Session, worker_id: str):
+    """
+    Claims the oldest runnable job: either QUEUED and due, or RUNNING with an
+    expired lease (its worker died or stalled).
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED so concurrent workers never block on
+    or double-claim the same row. SQLite ignores the locking clause, which is
+    fine for single-worker local dev.
+    """
+    now = utcnow()
+    job = db.query(Job).filter(
+        or_(
+            and_(Job.status == JobStatus.QUEUED, Job.run_after <= now),
+            and_(Job.status == JobStatus.RUNNING, Job.lease_expires_at < now),
+        )
+    ).order_by(Job.id).with_for_update(skip_locked=True).first()
+
+    if not job:
+        db.rollback()
+        return None
+
+    if job.status == JobStatus.RUNNING:
+        print(f"Reclaiming job {job.id} from {job.locked_by} (lease expired)")
+
+    job.status = JobStatus.RUNNING
+    job.locked_by = worker_id
+    job.attempts = (job.attempts or 0) + 1
+    job.heartbeat_at = now
+    job.lease_expires_at = now + timedelta(seconds=LEASE_SECONDS)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def heartbeat(db: Session, job_id: int, worker_id: str) -> bool:
+    """
+    Extends the lease of a job we still own. Returns False if the job was
+    reclaimed by someone else in the meantime.
+    """
+    now = utcnow()
+    updated = db.query(Job).filter(
+        Job.id == job_id,
+        Job.locked_by == worker_id,
+        Job.status == JobStatus.RUNNING,
+    ).update({
+        Job.heartbeat_at: now,
+        Job.lease_expires_at: now + timedelta(seconds=LEASE_SECONDS),
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+def complete_job(db: Session, job_id: int, worker_id: str) -> bool:
+    """
+    Marks a job we still own as DONE. Returns False if it was reclaimed by
+    someone else in the meantime (their run decides the outcome).
+    """
+    updated = db.query(Job).filter(
+        Job.id == job_id,
+        Job.locked_by == worker_id,
+        Job.status == JobStatus.RUNNING,
+    ).update({
+        Job.status: JobStatus.DONE,
+        Job.finished_at: utcnow(),
+        Job.lease_expires_at: None,
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+def fail_job(db: Session, job_id: int, worker_id: str, error: str, retry: bool = True) -> bool:
+    """
+    Records a failed attempt of a job we still own (like complete_job, a job
+    reclaimed by someone else is left alone). With retry, the job is re-queued
+    with a delay until it runs out of attempts. Returns True if the job is now
+    permanently FAILED.
+    """
+    # Row lock: claim_job (SKIP LOCKED) can't reclaim it while we decide
+    job = db.query(Job).filter(
+        Job.id == job_id,
+        Job.locked_by == worker_id,
+        Job.status == JobStatus.RUNNING,
+    ).with_for_update().first()
+    if not job:
+        db.rollback()
+        return False
+
+    job.last_error = error[:2000] if error else None
+    job.lease_expires_at = None
+    job.locked_by = None
+    if not retry or (job.attempts or 0) >= MAX_ATTEMPTS:
+        job.status = JobStatus.FAILED
+        job.finished_at = utcnow()
+    else:
+        job.status = JobStatus.QUEUED
+        job.run_after = utcnow() + timedelta(seconds=RETRY_DELAY_SECONDS * job.attempts)
+    db.commit()
+    return job.status == JobStatus.FAILED
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import time
+from datetime import timedelta
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import LinkFetch, LinkFetchStatus
+from services.job_queue import utcnow
+
+# How long a finished download (and its analysis) is reused for later imports of the same link
+LINK_CACHE_TTL_HOURS = int(os.getenv("LINK_CACHE_TTL_HOURS", "24"))
+
+# A fetch nobody has finished within this time is considered abandoned and taken over
+LINK_FETCH_LEASE_SECONDS = int(os.getenv("LINK_FETCH_LEASE_SECONDS", "600"))
+
+# Followers poll the shared row this often, and give up after LINK_FETCH_WAIT_SECONDS
+LINK_FETCH_POLL_SECONDS = float(os.getenv("LINK_FETCH_POLL_SECONDS", "2"))
+LINK_FETCH_WAIT_SECONDS = int(os.getenv("LINK_FETCH_WAIT_SECONDS", "900"))
+
+# Fetches led by this process, so local followers don't have to poll the database
+_local_flights = {}
+
+def cache_ttl() -> timedelta:
+    return timedelta(hours=LINK_CACHE_TTL_HOURS)
+
+def _claim_fetch(key: str, owner: str):
+    """
+    Returns ("ready", {'path', 'content_hash'}) if the link was already
+    downloaded within the TTL, ("lead", None) if the caller now owns the
+    download, or ("wait", None) if someone else is downloading it.
+    """
+    db = SessionLocal()
+    try:
+        now = utcnow()
+        try:
+            db.add(LinkFetch(key=key, status=LinkFetchStatus.FETCHING, owner=owner, updated_at=now))
+            db.commit()
+            return "lead", None
+        except IntegrityError:
+            db.rollback()
+
+        fetch = db.query(LinkFetch).filter(LinkFetch.key == key).with_for_update().first()
+        if fetch is None:
+            return "wait", None # Deleted under us, try again on the next poll
+
+        updated_at = fetch.updated_at
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=now.tzinfo) # SQLite drops the timezone
+
+        if fetch.status == LinkFetchStatus.READY and updated_at > now - cache_ttl() \
+                and fetch.storage_path and os.path.exists(fetch.storage_path):
+            db.rollback()
+            return "ready", {"path": fetch.storage_path, "content_hash": fetch.content_hash}
+        if fetch.status == LinkFetchStatus.FETCHING and updated_at > now - timedelta(seconds=LINK_FETCH_LEASE_SECONDS):
+            db.rollback()
+            return "wait", None
+
+        # Failed, expired or abandoned: take it over
+        fetch.status = LinkFetchStatus.FETCHING
+        fetch.owner = owner
+        fetch.storage_path = None
+        fetch.content_hash = None
+        fetch.updated_at = now
+        db.commit()
+        return "lead", None
+    finally:
+        db.close()
+
+def _release_fetch(key: str, owner: str, result: dict = None):
+    db = SessionLocal()
+    try:
+        fetch = db.query(LinkFetch).filter(LinkFetch.key == key, LinkFetch.owner == owner).first()
+        if not fetch:
+            return # Lost it to a takeover; the new owner will finish it
+        if result:
+            fetch.status = LinkFetchStatus.READY
+            fetch.storage_path = result["path"]
+            fetch.content_hash = result["content_hash"]
+        else:
+            fetch.status = LinkFetchStatus.FAILED
+        fetch.updated_at = utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+async def _fetch_or_follow(key: str, owner: str, fetch) -> dict:
+    deadline = time.monotonic() + LINK_FETCH_WAIT_SECONDS
+    while True:
+        state, cached = await asyncio.to_thread(_claim_fetch, key, owner)
+        if state == "ready":
+            print(f"Link {key} already downloaded, reusing {cached['path']}")
+            return cached
+        if state == "lead":
+            try:
+                result = await fetch()
+            except Exception:
+                await asyncio.to_thread(_release_fetch, key, owner)
+                raise
+            await asyncio.to_thread(_release_fetch, key, owner, result)
+            return result
+        if time.monotonic() > deadline:
+            raise ValueError("Timed out waiting for another import of the same video.")
+        await asyncio.sleep(LINK_FETCH_POLL_SECONDS)
+
+async def fetch_link_once(key: str, owner: str, fetch) -> dict:
+    """
+    Single-flight download of a linked video. `fetch` is an async callable
+    returning {'path', 'content_hash'}; across all worker processes only one
+    caller per key runs it, everyone else waits for and shares its result.
+    Results are reused for LINK_CACHE_TTL_HOURS.
+    """
+    flight = _local_flights.get(key)
+    if flight is not None:
+        return await asyncio.shield(flight)
+
+    flight = asyncio.get_running_loop().create_future()
+    flight.add_done_callback(lambda f: f.cancelled() or f.exception()) # followers are optional
+    _local_flights[key] = flight
+    try:
+        result = await _fetch_or_follow(key, owner, fetch)
+        flight.set_result(result)
+        return result
+    except BaseException as e:
+        if isinstance(e, Exception):
+            flight.set_exception(e)
+        else:
+            flight.cancel()
+        raise
+    finally:
+        _local_flights.pop(key, None)
+
+def gc_link_fetches(db: Session) -> int:
+    """
+    Forgets shared downloads older than the cache TTL. The files themselves
+    stay: they are content-addressed and may belong to existing videos.
+    """
+    cutoff = utcnow() - cache_ttl()
+    removed = db.query(LinkFetch).filter(LinkFetch.updated_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return removed
@@ -0,0 +1,273 @@
+import json
+import os
+import struct
+import subprocess
+from functools import lru_cache
+
+FFPROBE_PATH = os.getenv("FFPROBE_PATH", "ffprobe")
+
+# Top-level box types that identify an ISO-BMFF (MP4/MOV/M4V/3GP) file
+ISO_BMFF_LEADING_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"}
+
+# Refuse to buffer absurd moov boxes (normal ones are well under a few MB)
+MAX_MOOV_BYTES = 64 * 1024 * 1024
+
+# Boxes whose children we descend into while looking for track metadata
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+def _iter_boxes(data: bytes, start: int = 0, end: int = None):
+    """
+    Yields (type, payload_start, payload_end) for the boxes in data[start:end].
+    """
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+def _parse_mvhd(data: bytes, start: int) -> float:
+    version = data[start]
+    if version == 1:
+        timescale, duration = struct.unpack(">IQ", data[start + 20:start + 32])
+    else:
+        timescale, duration = struct.unpack(">II", data[start + 12:start + 20])
+    return duration / timescale if timescale else None
+
+def _parse_mdhd(data: bytes, start: int):
+    version = data[start]
+    if version == 1:
+        return struct.unpack(">IQ", data[start + 20:start + 32])
+    return struct.unpack(">II", data[start + 12:start + 20])
+
+def _parse_trak(data: bytes, start: int, end: int) -> dict:
+    track = {}
+
+    def walk(s, e):
+        for box_type, ps, pe in _iter_boxes(data, s, e):
+            if box_type in CONTAINER_BOXES:
+                walk(ps, pe)
+            elif box_type == b"tkhd" and pe - ps >= 84:
+                # Width/height are 16.16 fixed point, the last 8 bytes of tkhd
+                width, height = struct.unpack(">II", data[pe - 8:pe])
+                track["width"] = width >> 16
+                track["height"] = height >> 16
+            elif box_type == b"mdhd":
+                track["timescale"], track["media_duration"] = _parse_mdhd(data, ps)
+            elif box_type == b"hdlr" and pe - ps >= 12:
+                # mdia's hdlr comes first; QuickTime adds a data handler in minf
+                track.setdefault("handler", data[ps + 8:ps + 12])
+            elif box_type == b"stsd" and pe - ps >= 16:
+                # First sample entry: size(4) + format(4)
+                track["codec"] = data[ps + 12:ps + 16].decode("latin-1").strip()
+            elif box_type == b"stts" and pe - ps >= 8:
+                count = struct.unpack(">I", data[ps + 4:ps + 8])[0]
+                samples = 0
+                for i in range(count):
+                    offset = ps + 8 + i * 8
+                    if offset + 8 > pe:
+                        break
+                    samples += struct.unpack(">I", data[offset:offset + 4])[0]
+                track["samples"] = samples
+
+    walk(start, end)
+    return track
+
+def parse_moov(moov: bytes) -> dict:
+    """
+    Extracts duration, video codec, resolution and fps from the payload of a
+    `moov` box.
+    """
+    info = {"duration": None, "codec": None, "width": None, "height": None, "fps": None}
+    for box_type, ps, pe in _iter_boxes(moov):
+        if box_type == b"mvhd":
+            info["duration"] = _parse_mvhd(moov, ps)
+        elif box_type == b"trak":
+            track = _parse_trak(moov, ps, pe)
+            if track.get("handler") != b"vide" or info["codec"]:
+                continue
+            info["codec"] = track.get("codec")
+            info["width"] = track.get("width")
+            info["height"] = track.get("height")
+            timescale = track.get("timescale")
+            media_duration = track.get("media_duration")
+            if timescale and media_duration and track.get("samples"):
+                info["fps"] = round(track["samples"] / (media_duration / timescale), 3)
+    return info
+
+def _read_moov(path: str) -> bytes:
+    """
+    Walks the top-level boxes of an MP4/MOV file and returns the moov payload,
+    seeking over mdat instead of reading it.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        pos = 0
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            header = f.read(16)
+            size, box_type = struct.unpack(">I4s", header[:8])
+            header_size = 8
+            if size == 1:
+                size = struct.unpack(">Q", header[8:16])[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - pos
+            if size < header_size:
+                break
+            if box_type == b"moov":
+                if size > MAX_MOOV_BYTES:
+                    raise ValueError(f"moov box too large ({size} bytes)")
+                f.seek(pos + header_size)
+                return f.read(size - header_size)
+            pos += size
+    raise ValueError("No moov box found")
+
+def _probe_mp4(path: str) -> dict:
+    info = parse_moov(_read_moov(path))
+    if not info["duration"]:
+        raise ValueError("mvhd box missing or empty")
+    info["container"] = "mp4"
+    return info
+
+def _probe_ffprobe(path: str) -> dict:
+    cmd = [
+        FFPROBE_PATH, "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        path
+    ]
+    output = subprocess.run(cmd, check=True, capture_output=True, timeout=30).stdout
+    data = json.loads(output)
+
+    info = {"duration": None, "codec": None, "width": None, "height": None, "fps": None}
+    fmt = data.get("format", {})
+    if fmt.get("duration"):
+        info["duration"] = float(fmt["duration"])
+    info["container"] = fmt.get("format_name")
+
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") != "video":
+            continue
+        info["codec"] = stream.get("codec_name")
+        info["width"] = stream.get("width")
+        info["height"] = stream.get("height")
+        rate = stream.get("avg_frame_rate") or stream.get("r_frame_rate")
+        if rate and "/" in rate:
+            num, den = rate.split("/")
+            if float(den):
+                info["fps"] = round(float(num) / float(den), 3)
+        if not info["duration"] and stream.get("duration"):
+            info["duration"] = float(stream["duration"])
+        break
+    return info
+
+def is_iso_bmff(header: bytes) -> bool:
+    return len(header) >= 8 and header[4:8] in ISO_BMFF_LEADING_BOXES
+
+@lru_cache(maxsize=512)
+def _probe_cached(path: str, size: int, mtime_ns: int) -> dict:
+    with open(path, "rb") as f:
+        header = f.read(8)
+    if is_iso_bmff(header):
+        try:
+            return _probe_mp4(path)
+        except Exception as e:
+            print(f"MP4 header parse failed for {path}, falling back to ffprobe: {e}")
+    return _probe_ffprobe(path)
+
+def probe_media(path: str) -> dict:
+    """
+    Returns {'duration', 'codec', 'width', 'height', 'fps', 'container'} for a
+    video file. MP4/MOV headers are parsed directly; anything else goes through
+    ffprobe. Results are cached per (path, size, mtime).
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return dict(_probe_cached(path, stat.st_size, stat.st_mtime_ns))
+
+class StreamingProbe:
+    """
+    Finds the moov box of an MP4/MOV upload while its bytes are still
+    arriving, so a file can be rejected before the rest of it is received.
+
+    Feed every chunk in order; `feed` returns the parse_moov() dict as soon as
+    moov is complete (right at the start for faststart files, at the tail
+    otherwise). Only the moov bytes are buffered; mdat is skipped over.
+    """
+    def __init__(self):
+        self.offset = 0 # absolute offset of the next byte fed
+        self.next_box = 0 # absolute offset of the next top-level box header
+        self.header = bytearray()
+        self.moov = None
+        self.moov_end = None
+        self.info = None
+        self.done = False
+
+    def feed(self, chunk: bytes):
+        if self.done:
+            return None
+        i = 0
+        while i < len(chunk) and not self.done:
+            position = self.offset + i
+
+            if self.moov is not None:
+                take = min(self.moov_end - position, len(chunk) - i)
+                self.moov += chunk[i:i + take]
+                i += take
+                if self.offset + i >= self.moov_end:
+                    self.done = True
+                    try:
+                        self.info = parse_moov(bytes(self.moov))
+                    except Exception as e:
+                        print(f"Streaming moov parse failed: {e}")
+                    self.moov = None
+                continue
+
+            if position < self.next_box:
+                i += min(self.next_box - position, len(chunk) - i)
+                continue
+
+            # At a top-level box header: collect 8 bytes (16 for 64-bit sizes)
+            need = 8 if len(self.header) < 8 else 16
+            take = min(need - len(self.header), len(chunk) - i)
+            self.header += chunk[i:i + take]
+            i += take
+            if len(self.header) < need:
+                continue
+
+            size, box_type = struct.unpack(">I4s", bytes(self.header[:8]))
+            if self.next_box == 0 and box_type not in ISO_BMFF_LEADING_BOXES:
+                self.done = True # Not ISO-BMFF, leave it to probe_media later
+                break
+            if size == 1 and len(self.header) < 16:
+                continue
+            header_size = len(self.header)
+            if size == 1:
+                size = struct.unpack(">Q", bytes(self.header[8:16]))[0]
+            box_start = self.next_box
+            self.header = bytearray()
+
+            if size == 0 or size < header_size:
+                self.done = True # Box runs to EOF or is corrupt
+                break
+            if box_type == b"moov":
+                if size > MAX_MOOV_BYTES:
+                    self.done = True
+                    break
+                self.moov = bytearray()
+                self.moov_end = box_start + size
+            self.next_box = box_start + size
+
+        self.offset += len(chunk)
+        return self.info
@@ -0,0 +1,35 @@
+import threading
+from collections import Counter
+
+# Process-local metrics (e.g. how often Gemini output needed repair, limiter
+# queue depth). The worker logs them periodically; the API exposes its own
+# at /debug/metrics.
+_counters = Counter()
+_gauges = {}
+_timings = {} # name -> {"count", "total", "max"} in seconds
+_lock = threading.Lock()
+
+def increment(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+def observe(name: str, seconds: float):
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+
+def snapshot() -> dict:
+    with _lock:
+        data = dict(_counters)
+        data.update(_gauges)
+        for name, timing in _timings.items():
+            data[f"{name}.count"] = timing["count"]
+            data[f"{name}.avg"] = round(timing["total"] / timing["count"], 3)
+            data[f"{name}.max"] = round(timing["max"], 3)
+        return data
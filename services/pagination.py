@@ -0,0 +1,60 @@
+import base64
+import json
+import os
+from datetime import datetime
+from sqlalchemy import func, literal, tuple_
+
+# Keyset pagination over (created_at, id), newest first
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def page_size(limit: int) -> int:
+    return max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    payload = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Returns (created_at, id). Raises ValueError for anything that isn't one of our cursors."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(payload)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _comparable(query, column, value: datetime):
+    """
+    (column, value) for comparing a timestamp column with a datetime, the value
+    bound as the column's own type. SQLite keeps timestamps as text in whatever
+    format wrote them (CURRENT_TIMESTAMP has no fraction of a second, bound
+    datetimes do), so there both sides are compared as julianday numbers.
+    """
+    bound = literal(value, type_=column.type)
+    if query.session.get_bind().dialect.name == "sqlite":
+        return func.julianday(column), func.julianday(bound)
+    return column, bound
+
+def keyset_page(query, model, cursor: str = None, since: datetime = None, limit: int = None):
+    """
+    Applies newest-first keyset pagination on model.created_at/model.id to
+    `query`: rows strictly after `cursor` (from a previous page), optionally
+    only those created after `since`, at most page_size(limit) of them.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        column, value = _comparable(query, model.created_at, created_at)
+        query = query.filter(tuple_(column, model.id) < tuple_(value, row_id))
+    if since:
+        column, value = _comparable(query, model.created_at, since)
+        query = query.filter(column > value)
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(page_size(limit))
+
+def next_cursor(rows: list, limit: int, key=lambda row: row):
+    """Cursor for the page after `rows`, or None if this was the last one."""
+    if len(rows) < page_size(limit):
+        return None
+    last = key(rows[-1])
+    return encode_cursor(last.created_at, last.id)
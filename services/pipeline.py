@@ -0,0 +1,539 @@
+import asyncio
+import os
+import time
+import traceback
+from database import SessionLocal
+from models import Video, Analysis, User, AnalysisStatus
+from services.video_processor import download_video, probe_video, make_proxy, split_video, cut_clip
+from services.media_probe import probe_media
+from services.analysis_cache import RESULT_FIELDS, build_context, context_key, find_reusable_analysis, find_inflight_analysis, copy_result
+from services.credits import MAX_DURATION_SECONDS, InsufficientCredits, cost_for_duration, debit_credits
+from services.storage import store_file
+from services.job_queue import MAX_ATTEMPTS, utcnow
+from services.events import notify_analysis, publish_progress
+from services.download_scheduler import get_download_scheduler, is_throttle_error
+from services.gemini_limiter import is_retryable
+from services.link_cache import fetch_link_once, cache_ttl, LINK_FETCH_POLL_SECONDS, LINK_FETCH_WAIT_SECONDS
+from services.gemini_analyzer import TruncatedGeneration, upload_video_file_async, generate_video_analysis_async, analyze_script_content_async, generate_hook_analysis_async, merge_segment_results
+
+# How many jobs each stage works on at once (per worker process)
+STAGE_CONCURRENCY = {
+    "download": int(os.getenv("PIPELINE_DOWNLOAD_CONCURRENCY", "4")),
+    "transcode": int(os.getenv("PIPELINE_TRANSCODE_CONCURRENCY", "2")), # ffmpeg, CPU bound
+    "upload": int(os.getenv("PIPELINE_UPLOAD_CONCURRENCY", "8")),
+    "generate": int(os.getenv("PIPELINE_GENERATE_CONCURRENCY", "16")),
+    "persist": int(os.getenv("PIPELINE_PERSIST_CONCURRENCY", "4")),
+}
+
+# Videos longer than this are analyzed as parallel segments and merged
+MAP_REDUCE_MIN_SECONDS = int(os.getenv("MAP_REDUCE_MIN_SECONDS", "300"))
+
+# Hook-first preview: the opening is analyzed on its own and shown (status
+# PARTIAL) while the full analysis runs. Not worth it for very short videos.
+HOOK_SECONDS = int(os.getenv("HOOK_SECONDS", "5"))
+HOOK_MIN_VIDEO_SECONDS = int(os.getenv("HOOK_MIN_VIDEO_SECONDS", "20"))
+
+# Download progress events (SSE) at most this often per analysis
+PROGRESS_EVENT_SECONDS = float(os.getenv("PROGRESS_EVENT_SECONDS", "1"))
+
+# Bounded hand-off queue in front of every stage
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+
+class PipelineJob:
+    """
+    One analysis moving through the pipeline. Each stage reads what the
+    previous stages filled in and adds its own output.
+    """
+    def __init__(self, job_id: int, payload: dict, attempt: int = 1):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.analysis_id = payload["analysis_id"]
+        self.video_id = payload.get("video_id")
+        self.url = payload.get("url")
+        self.video_path = payload.get("video_path")
+        self.source_type = None
+        self.script_content = None
+        self.context = {}
+        self.content_hash = None
+        self.user_id = None
+        self.upload_path = None # analysis rendition sent to Gemini, if not the original
+        self.segments = None # long videos: [{'path', 'start', 'duration'}]
+        self.gemini_file = None
+        self.gemini_files = None # one per segment
+        self.result = None
+        self.finished = False # set by a stage to skip the remaining stages
+        self.wait = None # set by a stage: awaited outside any stage slot before the next stage
+        self.retry = False # failed, but worth another attempt (see _finish)
+
+    @property
+    def is_script(self) -> bool:
+        return self.source_type == "script"
+
+def is_transient(error: Exception) -> bool:
+    """Failures that say nothing about the video itself: quota, throttling, network, a cut-off response."""
+    return is_retryable(error) or is_throttle_error(error) or isinstance(error, (ConnectionError, TimeoutError, TruncatedGeneration))
+
+def _set_status(analysis_id: int, status: AnalysisStatus, keep: tuple = ()):
+    """
+    Sets the analysis status, unless it is currently one of `keep`.
+    """
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
+        if analysis and analysis.status not in keep:
+            analysis.status = status
+            notify_analysis(db, analysis)
+            db.commit()
+    finally:
+        db.close()
+
+def _start_job(job: PipelineJob):
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == job.analysis_id).first()
+        if not analysis:
+            raise ValueError(f"Analysis {job.analysis_id} not found")
+
+        # Update status to PROCESSING (covers downloading)
+        analysis.status = AnalysisStatus.PROCESSING
+        notify_analysis(db, analysis)
+        db.commit()
+
+        job.video_id = analysis.video_id
+        job.user_id = analysis.user_id
+        job.source_type = analysis.video.source_type
+        job.script_content = analysis.video.script_content
+        if not job.video_path:
+            job.video_path = analysis.video.storage_path
+        job.content_hash = analysis.video.content_hash
+
+        # Context for Gemini
+        job.context = build_context(analysis.video.platform_guess, analysis.user)
+    finally:
+        db.close()
+
+def _check_probe(job: PipelineJob, probe: dict):
+    """
+    Runs on link metadata before any media is fetched: enforces the length
+    limit and credit cost, and records what the link points to.
+    """
+    db = SessionLocal()
+    try:
+        duration = probe.get('duration') or 0
+        if duration > MAX_DURATION_SECONDS:
+            raise ValueError("Video exceeds the 25-minute limit.")
+
+        cost = cost_for_duration(duration)
+        analysis = db.query(Analysis).filter(Analysis.id == job.analysis_id).first()
+        user = db.query(User).filter(User.id == analysis.user_id).first()
+        if user.credits < cost:
+            raise ValueError(f"Insufficient credits for link import. User has {user.credits}, needs {cost}")
+
+        video = db.query(Video).filter(Video.id == job.video_id).first()
+        video.source_key = probe['source_key']
+        video.duration = duration
+        video.title = probe['title'] # Save YouTube/TikTok title
+        video.platform_guess = probe['platform']
+        db.commit()
+        job.context["platform"] = probe['platform'] or "Unknown"
+    finally:
+        db.close()
+
+def _apply_download(job: PipelineJob, listed_duration: float):
+    """
+    Charges for the import and records the stored file. Length limit and cost
+    come from the downloaded file itself; link metadata (`listed_duration`)
+    is often missing or rounded and only used if the file can't be probed.
+    """
+    duration = _duration(job.video_path) or listed_duration
+    if duration > MAX_DURATION_SECONDS:
+        raise ValueError("Video exceeds the 25-minute limit.")
+
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == job.analysis_id).first()
+
+        # Determing Cost
+        cost = cost_for_duration(duration)
+
+        # Deduct (atomic; a re-run of the same job isn't charged twice)
+        try:
+            debit_credits(db, analysis.user_id, cost, analysis_id=analysis.id, reason="link import")
+        except InsufficientCredits:
+            raise ValueError(f"Insufficient credits for link import. Needs {cost}")
+        # Known up front so concurrent imports of the same video can find this one
+        analysis.context_key = context_key(job.context)
+        db.commit()
+
+        # Update Video record
+        video = db.query(Video).filter(Video.id == job.video_id).first()
+        if video:
+            video.storage_path = job.video_path
+            video.content_hash = job.content_hash
+            video.duration = duration
+            db.commit()
+    finally:
+        db.close()
+
+def _reuse_analysis(job: PipelineJob):
+    """
+    Copies a recent completed analysis of the same bytes and context, and
+    finishes the job. Otherwise returns the id of an older analysis of them
+    that is still running (worth waiting for), or None.
+    """
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == job.analysis_id).first()
+        previous = find_reusable_analysis(db, job.content_hash, job.context, since=utcnow() - cache_ttl())
+        if previous and previous.id != analysis.id:
+            print(f"Reused Analysis ID {previous.id} for Analysis {analysis.id} (same video)")
+            copy_result(previous, analysis)
+            notify_analysis(db, analysis)
+            db.commit()
+            job.finished = True
+            return None
+        running = find_inflight_analysis(db, job.content_hash, job.context, analysis.id)
+        return running.id if running else None
+    finally:
+        db.close()
+
+async def _share_analysis(job: PipelineJob):
+    """
+    Single-flight for the Gemini run: if the same video is already being
+    analyzed for the same context, wait for that result instead of paying for
+    a second one. Falls back to running our own after LINK_FETCH_WAIT_SECONDS.
+    """
+    deadline = time.monotonic() + LINK_FETCH_WAIT_SECONDS
+    while True:
+        running = await asyncio.to_thread(_reuse_analysis, job)
+        if running is None:
+            return
+        if time.monotonic() > deadline:
+            print(f"Gave up waiting on Analysis {running} for Analysis {job.analysis_id}, analyzing separately")
+            return
+        await asyncio.sleep(LINK_FETCH_POLL_SECONDS)
+
+def _save_result(job: PipelineJob):
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == job.analysis_id).first()
+        result = job.result
+        analysis.overall_score = result.get("overall_score")
+        analysis.subscores = result.get("subscores")
+        analysis.insights = result.get("insights")
+        analysis.optimized_assets = result.get("optimized_assets")
+        analysis.checklist = result.get("checklist")
+        analysis.context_key = context_key(job.context)
+        analysis.status = AnalysisStatus.COMPLETED
+        notify_analysis(db, analysis)
+        db.commit()
+    finally:
+        db.close()
+
+def _progress_reporter(job: PipelineJob):
+    """
+    yt-dlp progress callback: publishes progress events (throttled to one per
+    PROGRESS_EVENT_SECONDS, plus the final one) and logs every 25%.
+    """
+    logged = [0]
+    published = [0.0]
+
+    def on_progress(downloaded: int, total):
+        now = time.monotonic()
+        if now - published[0] >= PROGRESS_EVENT_SECONDS or (total and downloaded >= total):
+            published[0] = now
+            try:
+                publish_progress(job.analysis_id, job.user_id, downloaded, total)
+            except Exception as e:
+                print(f"Could not publish progress for Analysis {job.analysis_id}: {e}")
+        if total:
+            percent = int(downloaded * 100 / total) // 25 * 25
+            if percent > logged[0]:
+                logged[0] = percent
+                print(f"Analysis {job.analysis_id}: downloaded {downloaded // 1024} / {total // 1024} KB ({percent}%)")
+    return on_progress
+
+def _duration(path: str) -> float:
+    try:
+        return probe_media(path).get("duration") or 0
+    except Exception as e:
+        print(f"Could not probe {path}: {e}")
+        return 0
+
+def _save_hook(job: PipelineJob, hook: dict) -> bool:
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == job.analysis_id).with_for_update().first()
+        # The full result may already be in (or the job failed): never overwrite it
+        if not analysis or analysis.status not in (AnalysisStatus.PROCESSING, AnalysisStatus.ANALYZING):
+            return False
+        analysis.subscores = {"hook": hook}
+        analysis.status = AnalysisStatus.PARTIAL
+        notify_analysis(db, analysis, section="hook")
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+async def _hook_preview(job: PipelineJob, source: str):
+    try:
+        clip = await asyncio.to_thread(cut_clip, source, job.content_hash, HOOK_SECONDS)
+        clip_file = await upload_video_file_async(clip)
+        hook = await generate_hook_analysis_async(clip_file, job.context)
+        if await asyncio.to_thread(_save_hook, job, hook):
+            print(f"Analysis {job.analysis_id}: preliminary hook score {hook.get('score')}")
+    except Exception as e:
+        # Only a preview: the full analysis still scores the hook
+        print(f"Hook preview failed for Analysis {job.analysis_id}: {e}")
+
+def _save_section(job: PipelineJob, key: str, value):
+    """
+    Persists one streamed top-level section (see gemini_analyzer.JsonSectionParser)
+    so it can be shown before the whole response is in.
+    """
+    if key not in RESULT_FIELDS:
+        return
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == job.analysis_id).with_for_update().first()
+        if not analysis or analysis.status in (AnalysisStatus.COMPLETED, AnalysisStatus.FAILED):
+            return
+        setattr(analysis, key, value)
+        analysis.status = AnalysisStatus.PARTIAL
+        notify_analysis(db, analysis, section=key)
+        db.commit()
+    finally:
+        db.close()
+
+def _section_saver(job: PipelineJob):
+    async def on_section(key: str, value):
+        try:
+            await asyncio.to_thread(_save_section, job, key, value)
+        except Exception as e:
+            # The full result is saved at the end anyway
+            print(f"Could not save partial '{key}' for Analysis {job.analysis_id}: {e}")
+    return on_section
+
+# Keeps background preview tasks referenced until they finish
+_background_tasks = set()
+
+def _start_hook_preview(job: PipelineJob, source: str):
+    task = asyncio.create_task(_hook_preview(job, source))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def download_stage(job: PipelineJob):
+    await asyncio.to_thread(_start_job, job)
+    if job.url:
+        scheduler = get_download_scheduler()
+        # Metadata only first: limits and credits are checked before any media is fetched
+        probe = await scheduler.run(job.url, probe_video, job.url)
+        await asyncio.to_thread(_check_probe, job, probe)
+
+        async def fetch():
+            print(f"Starting download for Analysis {job.analysis_id}, URL: {job.url}")
+            info = await scheduler.run(job.url, download_video, job.url, probe['info'], _progress_reporter(job))
+            stored = await asyncio.to_thread(store_file, info['path'], info['path'])
+            return {"path": stored['path'], "content_hash": stored['sha256']}
+
+        if probe['source_key']:
+            # Everyone importing this video right now shares one download
+            fetched = await fetch_link_once(probe['source_key'], f"analysis-{job.analysis_id}", fetch)
+        else:
+            fetched = await fetch()
+        job.video_path = fetched['path']
+        job.content_hash = fetched['content_hash']
+        await asyncio.to_thread(_apply_download, job, probe.get('duration') or 0)
+        # Can take many minutes: don't hold a download slot for it
+        job.wait = _share_analysis(job)
+
+async def transcode_stage(job: PipelineJob):
+    if job.is_script or not job.content_hash:
+        return
+
+    if await asyncio.to_thread(_duration, job.video_path) >= HOOK_MIN_VIDEO_SECONDS:
+        # Runs alongside the rest of the pipeline, outside any stage slot
+        _start_hook_preview(job, job.video_path)
+
+    try:
+        job.upload_path = await asyncio.to_thread(make_proxy, job.video_path, job.content_hash)
+    except Exception as e:
+        # Not worth failing the analysis over: Gemini takes the original too
+        print(f"Proxy transcode failed for Analysis {job.analysis_id}, uploading the original: {e}")
+
+    source = job.upload_path or job.video_path
+    duration = await asyncio.to_thread(_duration, source)
+    if duration > MAP_REDUCE_MIN_SECONDS:
+        # Cache key follows the file being cut (original or a specific proxy rung)
+        cache_key = os.path.splitext(os.path.basename(source))[0]
+        try:
+            segments = await asyncio.to_thread(split_video, source, cache_key)
+        except Exception as e:
+            print(f"Splitting failed for Analysis {job.analysis_id}, analyzing as one video: {e}")
+            return
+        if len(segments) > 1:
+            job.segments = segments
+            print(f"Analysis {job.analysis_id}: {int(duration)}s video split into {len(segments)} segments")
+
+async def _gather_all(coros) -> list:
+    """
+    Like asyncio.gather, but if one fails the others are cancelled instead of
+    running on (uploading or generating) for a job that already failed.
+    """
+    tasks = [asyncio.create_task(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def upload_stage(job: PipelineJob):
+    await asyncio.to_thread(_set_status, job.analysis_id, AnalysisStatus.ANALYZING, (AnalysisStatus.PARTIAL,))
+    if job.is_script:
+        return
+    if job.segments:
+        job.gemini_files = await _gather_all(upload_video_file_async(seg['path']) for seg in job.segments)
+    else:
+        job.gemini_file = await upload_video_file_async(job.upload_path or job.video_path)
+
+async def generate_stage(job: PipelineJob):
+    if job.is_script:
+        result = await analyze_script_content_async(job.script_content, job.context, _section_saver(job))
+    elif job.segments:
+        # Map: every segment in parallel, then reduce into one result
+        count = len(job.segments)
+        results = await _gather_all(
+            generate_video_analysis_async(video_file, job.context, {**seg, "index": i, "count": count})
+            for i, (seg, video_file) in enumerate(zip(job.segments, job.gemini_files))
+        )
+        result = merge_segment_results(results, job.segments)
+    else:
+        result = await generate_video_analysis_async(job.gemini_file, job.context, on_section=_section_saver(job))
+
+    # Validate result
+    if not result or result.get("overall_score") is None:
+        raise ValueError(f"Analysis returned incomplete data: {result}")
+    job.result = result
+
+async def persist_stage(job: PipelineJob):
+    await asyncio.to_thread(_save_result, job)
+
+class StagedPipeline:
+    """
+    Runs jobs through an ordered list of (name, coroutine, concurrency) stages.
+
+    Every stage has a bounded input queue and its own fixed number of workers,
+    so different jobs occupy different stages at the same time and a slow
+    download never holds a slot a Gemini generation could use. When a queue is
+    full, the stage in front of it waits, which pushes back all the way to
+    `submit`.
+    """
+    def __init__(self, stages, on_finish, queue_size: int = QUEUE_SIZE):
+        self.stages = stages
+        self.on_finish = on_finish
+        self.queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+        self.tasks = []
+        self.parked = set() # jobs awaiting their `wait` between two stages
+
+    def start(self):
+        for index, (name, _, concurrency) in enumerate(self.stages):
+            for n in range(concurrency):
+                self.tasks.append(asyncio.create_task(self._stage_worker(index), name=f"{name}-{n}"))
+
+    async def submit(self, job: PipelineJob):
+        await self.queues[0].put(job)
+
+    def queue_depths(self) -> dict:
+        depths = {name: self.queues[i].qsize() for i, (name, _, _) in enumerate(self.stages)}
+        depths["parked"] = len(self.parked)
+        return depths
+
+    async def _stage_worker(self, index: int):
+        name, stage, _ = self.stages[index]
+        queue = self.queues[index]
+        while True:
+            job = await queue.get()
+            try:
+                await stage(job)
+            except Exception as e:
+                self._report(job, name, e)
+                await self._finish(job, e)
+                continue
+            finally:
+                queue.task_done()
+
+            if job.wait is not None:
+                self._park(index, job)
+            else:
+                await self._forward(index, job)
+
+    def _report(self, job: PipelineJob, name: str, error: Exception):
+        print(f"CRITICAL ANALYSIS FAILURE ID {job.analysis_id} in stage '{name}': {error}")
+        traceback.print_exc() # This prints to stderr which Railway captures
+
+    async def _forward(self, index: int, job: PipelineJob):
+        if index + 1 < len(self.queues) and not job.finished:
+            await self.queues[index + 1].put(job)
+        else:
+            await self._finish(job, None)
+
+    def _park(self, index: int, job: PipelineJob):
+        """
+        Awaits job.wait in its own task, so the stage's slot is free for the
+        next job meanwhile, then hands the job on. The number of parked jobs is
+        bounded by the worker's in-flight limit.
+        """
+        wait, job.wait = job.wait, None
+        name = self.stages[index][0]
+
+        async def resume():
+            try:
+                await wait
+            except Exception as e:
+                self._report(job, name, e)
+                await self._finish(job, e)
+                return
+            await self._forward(index, job)
+
+        task = asyncio.create_task(resume(), name=f"{name}-parked-{job.job_id}")
+        self.parked.add(task)
+        task.add_done_callback(self.parked.discard)
+
+    async def _finish(self, job: PipelineJob, error):
+        if error is not None:
+            # Transient failures go back to the queue (not FAILED, which refunds the
+            # charge); sections already shown stay PARTIAL until the retry replaces them
+            job.retry = is_transient(error) and job.attempt < MAX_ATTEMPTS
+            status = AnalysisStatus.QUEUED if job.retry else AnalysisStatus.FAILED
+            keep = (AnalysisStatus.PARTIAL,) if job.retry else ()
+            try:
+                await asyncio.to_thread(_set_status, job.analysis_id, status, keep)
+            except Exception as e:
+                print(f"Failed to mark Analysis {job.analysis_id} as {status.value}: {e}")
+        try:
+            await self.on_finish(job, error)
+        except Exception as e:
+            print(f"Pipeline finish callback failed for job {job.job_id}: {e}")
+
+def build_pipeline(on_finish) -> StagedPipeline:
+    """
+    download -> proxy transcode -> Gemini upload -> generate -> persist, with per-stage
+    concurrency from STAGE_CONCURRENCY.
+    """
+    return StagedPipeline([
+        ("download", download_stage, STAGE_CONCURRENCY["download"]),
+        ("transcode", transcode_stage, STAGE_CONCURRENCY["transcode"]),
+        ("upload", upload_stage, STAGE_CONCURRENCY["upload"]),
+        ("generate", generate_stage, STAGE_CONCURRENCY["generate"]),
+        ("persist", persist_stage, STAGE_CONCURRENCY["persist"]),
+    ], on_finish)
+
+def thread_budget() -> int:
+    """
+    Threads needed so every stage slot that blocks in a thread can do so at
+    once. Generation is natively async and only needs the persist share.
+    """
+    return (STAGE_CONCURRENCY["download"] + STAGE_CONCURRENCY["transcode"]
+            + STAGE_CONCURRENCY["upload"] + STAGE_CONCURRENCY["persist"] + 4)
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import uuid
+from services.media_probe import StreamingProbe, probe_media
+
+UPLOAD_DIR = "uploads"
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Partial files of resumable uploads (same filesystem so finishing is a rename)
+PARTIAL_DIR = os.path.join(UPLOAD_DIR, ".partial")
+
+CHUNK_SIZE = 1024 * 1024 # 1 MB
+
+def content_path(sha256: str, filename: str = None) -> str:
+    """
+    Storage path for a blob: uploads/<sha256><original extension>.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    return os.path.join(UPLOAD_DIR, f"{sha256}{ext}")
+
+class UploadWriter:
+    """
+    Incremental, content-addressed writer: hashes and probes each chunk as it
+    is written, then moves the file to uploads/<sha256><ext> on finish().
+    Identical bytes are only kept once.
+
+    If on_probe is given, it is called with the container metadata (see
+    media_probe.StreamingProbe) as soon as the headers have been seen. It may
+    raise to abort the transfer; call abort() to remove the partial file.
+    """
+    def __init__(self, filename: str, on_probe=None):
+        self.filename = filename
+        self.on_probe = on_probe
+        self.tmp_path = os.path.join(UPLOAD_DIR, f".tmp-{uuid.uuid4().hex}")
+        self.digest = hashlib.sha256()
+        self.probe = StreamingProbe()
+        self.media = None
+        self.size = 0
+        self.buffer = open(self.tmp_path, "wb")
+
+    def write(self, chunk: bytes):
+        if self.media is None:
+            self.media = self.probe.feed(chunk)
+            if self.media is not None and self.on_probe:
+                self.on_probe(self.media)
+        self.digest.update(chunk)
+        self.buffer.write(chunk)
+        self.size += len(chunk)
+
+    def finish(self) -> dict:
+        """
+        Returns a dict with 'path', 'sha256', 'size', 'created' (False if the
+        blob was already stored) and 'media' (probe result or None).
+        """
+        self.buffer.close()
+        sha256 = self.digest.hexdigest()
+        path = content_path(sha256, self.filename)
+        created = not os.path.exists(path)
+        if created:
+            os.replace(self.tmp_path, path)
+        else:
+            os.remove(self.tmp_path)
+        return {"path": path, "sha256": sha256, "size": self.size, "created": created, "media": self.media}
+
+    def abort(self):
+        self.buffer.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def save_upload(fileobj, filename: str, on_probe=None) -> dict:
+    """
+    Streams a file object to content-addressed storage (see UploadWriter).
+    'media' is always filled in: containers the streaming probe can't read are
+    probed once stored ({} if that fails too), so callers never have to.
+    """
+    writer = UploadWriter(filename, on_probe=on_probe)
+    try:
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+        stored = writer.finish()
+    except Exception:
+        writer.abort()
+        raise
+    if stored["media"] is None:
+        try:
+            stored["media"] = probe_media(stored["path"])
+        except Exception as e:
+            print(f"Error checking duration: {e}")
+            stored["media"] = {}
+    return stored
+
+def store_file(src_path: str, filename: str) -> dict:
+    """
+    Moves a fully written file (e.g. an assembled resumable upload) into
+    content-addressed storage. Returns the same dict as UploadWriter.finish().
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(src_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+
+    sha256 = digest.hexdigest()
+    path = content_path(sha256, filename)
+    created = not os.path.exists(path)
+    if created:
+        os.replace(src_path, path)
+    else:
+        os.remove(src_path)
+    return {"path": path, "sha256": sha256, "size": size, "created": created, "media": None}
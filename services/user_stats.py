@@ -0,0 +1,106 @@
+"""
+Incrementally maintained per-user aggregates behind /api/videos/stats/overview.
+
+Every video counts towards video_count. Its score is the one of its latest
+COMPLETED analysis. The rows are updated by ORM flush listeners, on the
+flush's own connection, so they commit or roll back together with the change.
+That covers every path that completes an analysis or removes a video
+(pipeline, result reuse, admin). backfill_user_stats.py rebuilds them from
+scratch.
+"""
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session
+from models import Analysis, AnalysisStatus, UserStats, Video
+
+HISTOGRAM_BUCKETS = 10 # 0-9, 10-19, ..., 90-100
+
+analyses = Analysis.__table__
+user_stats = UserStats.__table__
+
+def category_of(context_key: str) -> str:
+    # context_key is "platform|category"
+    return context_key.split("|")[-1] if context_key else "general"
+
+def _bucket(score: int) -> int:
+    return max(0, min(int(score) // 10, HISTOGRAM_BUCKETS - 1))
+
+def _contribution(row):
+    """(score, category) a latest completed analysis adds to its user's stats, or None."""
+    if row is None or row.overall_score is None:
+        return None
+    return row.overall_score, category_of(row.context_key)
+
+def empty_stats(user_id: int) -> dict:
+    return {"user_id": user_id, "video_count": 0, "analyzed_count": 0, "score_sum": 0, "score_histogram": {}}
+
+def add_contribution(stats: dict, contribution, sign: int = 1):
+    if contribution is None:
+        return
+    score, category = contribution
+    histogram = stats["score_histogram"].setdefault(category, [0] * HISTOGRAM_BUCKETS)
+    histogram[_bucket(score)] += sign
+    stats["analyzed_count"] += sign
+    stats["score_sum"] += sign * score
+
+def _apply(connection, user_id: int, videos: int = 0, add=None, remove=None):
+    connection.execute(
+        text("INSERT INTO user_stats (user_id, video_count, analyzed_count, score_sum) VALUES (:user_id, 0, 0, 0) ON CONFLICT (user_id) DO NOTHING"),
+        {"user_id": user_id},
+    )
+    row = connection.execute(select(user_stats).where(user_stats.c.user_id == user_id).with_for_update()).first()
+    stats = {
+        "user_id": user_id,
+        "video_count": row.video_count + videos,
+        "analyzed_count": row.analyzed_count,
+        "score_sum": row.score_sum,
+        "score_histogram": {category: list(counts) for category, counts in (row.score_histogram or {}).items()},
+    }
+    add_contribution(stats, remove, -1)
+    add_contribution(stats, add)
+    connection.execute(user_stats.update().where(user_stats.c.user_id == user_id).values(**stats))
+
+def _latest_completed(connection, video_id: int, limit: int = 1):
+    return connection.execute(
+        select(analyses.c.id, analyses.c.overall_score, analyses.c.context_key)
+        .where(analyses.c.video_id == video_id, analyses.c.status == AnalysisStatus.COMPLETED)
+        .order_by(analyses.c.created_at.desc(), analyses.c.id.desc())
+        .limit(limit)
+    ).all()
+
+@event.listens_for(Analysis, "after_insert")
+@event.listens_for(Analysis, "after_update")
+def _analysis_completed(mapper, connection, target):
+    if AnalysisStatus.COMPLETED not in inspect(target).attrs.status.history.added or target.video_id is None:
+        return
+    video_user = connection.execute(select(Video.__table__.c.user_id).where(Video.__table__.c.id == target.video_id)).scalar()
+    if video_user is None:
+        return
+    latest = _latest_completed(connection, target.video_id, limit=2)
+    if not latest or latest[0].id != target.id:
+        return # a newer analysis of the video already counts
+    previous = latest[1] if len(latest) > 1 else None
+    _apply(connection, video_user, add=_contribution(latest[0]), remove=_contribution(previous))
+
+@event.listens_for(Video, "after_insert")
+def _video_added(mapper, connection, target):
+    if target.user_id is not None:
+        _apply(connection, target.user_id, videos=1)
+
+@event.listens_for(Video, "before_delete")
+def _video_deleted(mapper, connection, target):
+    if target.user_id is None:
+        return
+    latest = _latest_completed(connection, target.id)
+    _apply(connection, target.user_id, videos=-1, remove=_contribution(latest[0] if latest else None))
+
+def stats_overview(db: Session, user_id: int) -> dict:
+    stats = db.get(UserStats, user_id)
+    if stats is None:
+        return empty_stats(user_id)
+    return {
+        "user_id": user_id,
+        "video_count": stats.video_count,
+        "analyzed_count": stats.analyzed_count,
+        "score_sum": stats.score_sum,
+        "score_histogram": stats.score_histogram or {},
+    }
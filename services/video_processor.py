@@ -1,23 +1,54 @@
 import os
+import shutil
 import subprocess
+import threading
+import time
 import yt_dlp
+from contextlib import contextmanager
 from datetime import datetime
+from services.media_probe import probe_media
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
 
-def download_video(url: str) -> dict:
-    """
-    Downloads a video from a URL using yt-dlp.
-    Returns a dict with 'path', 'duration', 'title', 'platform'.
-    """
-    
+YDL_CONCURRENT_FRAGMENTS = int(os.getenv("YDL_CONCURRENT_FRAGMENTS", "4"))
+# Idle YoutubeDL instances kept per site profile
+YDL_POOL_SIZE = int(os.getenv("YDL_POOL_SIZE", "4"))
+
+# Analysis renditions sent to Gemini instead of the original file.
+# Gemini samples video at ~1 fps, so frame rate and resolution can drop a lot.
+PROXY_DIR = os.path.join(UPLOAD_DIR, "proxies")
+PROXY_LADDER = {
+    # short side (px), max fps, video bitrate, audio bitrate
+    "low": {"short_side": 360, "fps": 10, "video_bitrate": "350k", "audio_bitrate": "48k"},
+    "medium": {"short_side": 480, "fps": 15, "video_bitrate": "700k", "audio_bitrate": "64k"},
+    "high": {"short_side": 720, "fps": 24, "video_bitrate": "1500k", "audio_bitrate": "96k"},
+}
+PROXY_QUALITY = os.getenv("PROXY_QUALITY", "medium") # one of PROXY_LADDER, or "off"
+PROXY_TIMEOUT_SECONDS = int(os.getenv("PROXY_TIMEOUT_SECONDS", "600"))
+
+# Long videos are analyzed as segments of about this length (cut on keyframes)
+SEGMENT_DIR = os.path.join(UPLOAD_DIR, "segments")
+SEGMENT_SECONDS = int(os.getenv("SEGMENT_SECONDS", "180"))
+
+# Proxies, segments and hook clips are caches: the janitor removes those not
+# used for this long (every cache hit refreshes the modification time)
+DERIVED_FILES_TTL_HOURS = float(os.getenv("DERIVED_FILES_TTL_HOURS", "24"))
+
+def _ydl_profile(url: str) -> str:
+    if "instagram.com" in url:
+        return "instagram"
+    if "tiktok.com" in url:
+        return "tiktok"
+    return "default"
+
+def _ydl_options(profile: str) -> dict:
     # specialized options for Instagram to avoid blocks
     # note: instagram is very aggressive with blocks without cookies
-    is_instagram = "instagram.com" in url
-    is_tiktok = "tiktok.com" in url
+    is_instagram = profile == "instagram"
+    is_tiktok = profile == "tiktok"
     
     ydl_opts = {
         # Limit quality to 1080p max to avoid huge files, but be flexible
@@ -25,8 +56,12 @@ def download_video(url: str) -> dict:
         'outtmpl': os.path.join(UPLOAD_DIR, '%(id)s.%(ext)s'),
         'quiet': False, # Enable logs for debugging
         'no_warnings': False,
-        'ignoreerrors': True, # Don't crash on minor errors
+        # Surface errors (429s, blocks) so the download scheduler can back off;
+        # callers turn them into a ValueError
+        'ignoreerrors': False,
         'geo_bypass': True,
+        # HLS/DASH: fetch this many fragments in parallel instead of one by one
+        'concurrent_fragment_downloads': YDL_CONCURRENT_FRAGMENTS,
         'nocheckcertificate': True,
         # Updated User Agent (Chrome 120 on Windows 10)
         'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -43,16 +78,111 @@ def download_video(url: str) -> dict:
                     'max_comments': [0], # Don't download comments, triggers blocks
                     'api_limit': [0]
                 }
-            },
-            'sleep_interval': 5, # Slow down to look human
-            'max_sleep_interval': 10
+            }
         })
+        # Request pacing lives in services/download_scheduler.py
+    return ydl_opts
+
+class _PooledYDL:
+    """
+    A long-lived YoutubeDL plus the progress callback of whoever is using it.
+    Extractor instances and the HTTP session stay warm between downloads.
+    """
+    def __init__(self, profile: str):
+        self.profile = profile
+        self.on_progress = None
+        self.ydl = yt_dlp.YoutubeDL(_ydl_options(profile))
+        self.ydl.add_progress_hook(self._progress_hook)
+
+    def _progress_hook(self, d: dict):
+        if self.on_progress and d.get('status') in ('downloading', 'finished'):
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            self.on_progress(d.get('downloaded_bytes') or 0, total)
 
+_ydl_pool = {}
+_ydl_pool_lock = threading.Lock()
+
+@contextmanager
+def _borrow_ydl(url: str, on_progress=None):
+    """
+    Checks a YoutubeDL out of the pool for the URL's site profile (they are
+    not thread-safe, so one user at a time). Instances that raised are closed
+    rather than returned, in case they were left in a bad state.
+    """
+    profile = _ydl_profile(url)
+    with _ydl_pool_lock:
+        idle = _ydl_pool.setdefault(profile, [])
+        pooled = idle.pop() if idle else None
+    if pooled is None:
+        pooled = _PooledYDL(profile)
+
+    pooled.on_progress = on_progress
+    ok = False
+    try:
+        yield pooled.ydl
+        ok = True
+    finally:
+        pooled.on_progress = None
+        with _ydl_pool_lock:
+            idle = _ydl_pool[profile]
+            keep = ok and len(idle) < YDL_POOL_SIZE
+            if keep:
+                idle.append(pooled)
+        if not keep:
+            pooled.ydl.close()
+
+def probe_video(url: str) -> dict:
+    """
+    Resolves a URL with yt-dlp without downloading any media.
+    Returns a dict with 'id', 'duration', 'title', 'platform', 'source_key',
+    'formats' (available format ids) and 'info' (the raw info dict, which
+    download_video can reuse to skip a second extraction).
+    """
+    try:
+        print(f"Probing video metadata for {url}...")
+        with _borrow_ydl(url) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        print(f"Probe failed: {e}")
+        raise ValueError(f"Could not read video details. Access might be restricted or link is invalid. Error: {str(e)}")
+
+    if not info:
+        raise ValueError("Could not read video details (no info returned). The video might be private or deleted.")
+
+    # If it's a playlist or list (rare for single link, but possible)
+    if 'entries' in info:
+        entries = [e for e in info['entries'] if e]
+        if not entries:
+            raise ValueError("Link does not contain any playable video.")
+        info = entries[0]
+
+    extractor = info.get('extractor_key') or info.get('extractor')
+    return {
+        "id": info.get('id'),
+        "duration": info.get('duration'),
+        "title": info.get('title'),
+        "platform": info.get('extractor'),
+        "source_key": f"{extractor}:{info.get('id')}".lower() if info.get('id') else None,
+        "formats": [f.get('format_id') for f in info.get('formats') or []],
+        "info": info
+    }
+
+def download_video(url: str, info: dict = None, on_progress=None) -> dict:
+    """
+    Downloads a video from a URL using yt-dlp.
+    If `info` (from probe_video) is given, the media is fetched straight from
+    it instead of resolving the URL again. `on_progress(downloaded_bytes,
+    total_bytes)` is called as data arrives (total may be None).
+    Returns a dict with 'path', 'duration', 'title', 'platform'.
+    """
     try:
         print(f"Downloading video from {url}...")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # First try to extract info
-            info = ydl.extract_info(url, download=True)
+        with _borrow_ydl(url, on_progress) as ydl:
+            if info:
+                info = ydl.process_ie_result(info, download=True)
+            else:
+                # First try to extract info
+                info = ydl.extract_info(url, download=True)
             
             if not info:
                 raise ValueError("Download failed (no info returned). The video might be private or deleted.")
@@ -84,6 +214,173 @@ def download_video(url: str) -> dict:
         # Re-raise with a clear message
         raise ValueError(f"Could not download video. Access might be restricted or link is invalid. Error: {str(e)}")
 
+def _bitrate_kbps(value: str) -> int:
+    return int(value.rstrip("k"))
+
+def make_proxy(video_path: str, content_hash: str, quality: str = None) -> str:
+    """
+    Transcodes a low-resolution, low-fps, low-bitrate analysis rendition of a
+    video (see PROXY_LADDER) and returns its path. Renditions are cached by
+    content hash and rung. Returns the original path when proxies are off or
+    the source is already no bigger than the rung.
+    """
+    quality = quality or PROXY_QUALITY
+    rung = PROXY_LADDER.get(quality)
+    if rung is None:
+        return video_path
+
+    media = probe_media(video_path)
+    width, height, duration = media.get("width"), media.get("height"), media.get("duration")
+    if width and height and duration:
+        source_kbps = os.path.getsize(video_path) * 8 / 1000 / duration
+        target_kbps = _bitrate_kbps(rung["video_bitrate"]) + _bitrate_kbps(rung["audio_bitrate"])
+        if min(width, height) <= rung["short_side"] and source_kbps <= target_kbps * 1.5:
+            return video_path
+
+    os.makedirs(PROXY_DIR, exist_ok=True)
+    proxy_path = os.path.join(PROXY_DIR, f"{content_hash}-{quality}.mp4")
+    if os.path.exists(proxy_path):
+        _touch(proxy_path)
+        return proxy_path
+
+    fps = rung["fps"]
+    if media.get("fps"):
+        fps = min(fps, media["fps"])
+    side = rung["short_side"]
+    # Limit the short side so portrait and landscape get the same detail; never upscale
+    scale = (
+        f"scale='if(gt(iw,ih),-2,min({side},iw))':'if(gt(iw,ih),min({side},ih),-2)'"
+    )
+    tmp_path = f"{proxy_path}.{os.getpid()}.tmp.mp4"
+    cmd = [
+        FFMPEG_PATH, "-i", video_path,
+        "-vf", f"{scale},fps={fps}",
+        "-c:v", "libx264", "-preset", "veryfast",
+        "-b:v", rung["video_bitrate"], "-maxrate", rung["video_bitrate"],
+        "-bufsize", f"{_bitrate_kbps(rung['video_bitrate']) * 2}k",
+        "-c:a", "aac", "-b:a", rung["audio_bitrate"], "-ac", "1",
+        "-movflags", "+faststart",
+        tmp_path, "-y"
+    ]
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=PROXY_TIMEOUT_SECONDS)
+        os.replace(tmp_path, proxy_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    print(f"Proxy {quality} for {video_path}: {os.path.getsize(video_path) // 1024} KB -> {os.path.getsize(proxy_path) // 1024} KB")
+    return proxy_path
+
+def _touch(path: str):
+    try:
+        os.utime(path)
+    except OSError:
+        pass # evicted meanwhile: the caller's next run recreates it
+
+def gc_derived_files() -> int:
+    """
+    Janitor: removes proxies, segment directories and hook clips (and
+    temporary files left by crashed ffmpeg runs) not used for
+    DERIVED_FILES_TTL_HOURS. Originals under uploads/ are never touched.
+    Returns how many entries were removed.
+    """
+    cutoff = time.time() - DERIVED_FILES_TTL_HOURS * 3600
+    removed = 0
+    for directory in (PROXY_DIR, SEGMENT_DIR):
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+            except OSError as e:
+                print(f"Could not remove {path}: {e}")
+    return removed
+
+def split_video(video_path: str, cache_key: str, segment_seconds: int = None) -> list[dict]:
+    """
+    Cuts a video into consecutive segments of about `segment_seconds` with
+    ffmpeg stream copy (no re-encode, so cuts land on the nearest keyframe).
+    Returns [{'path', 'start', 'duration'}] in order. Cached by `cache_key`
+    (e.g. the content hash of the file being cut).
+    """
+    segment_seconds = segment_seconds or SEGMENT_SECONDS
+    ext = os.path.splitext(video_path)[1] or ".mp4"
+    segment_dir = os.path.join(SEGMENT_DIR, f"{cache_key}-{segment_seconds}")
+
+    if not os.path.isdir(segment_dir):
+        tmp_dir = f"{segment_dir}.{os.getpid()}-{threading.get_ident()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        # ffmpeg -i video.mp4 -c copy -map 0 -f segment -segment_time 180 -reset_timestamps 1 seg_%03d.mp4
+        cmd = [
+            FFMPEG_PATH, "-i", video_path,
+            "-c", "copy", "-map", "0",
+            "-f", "segment", "-segment_time", str(segment_seconds),
+            "-reset_timestamps", "1",
+            os.path.join(tmp_dir, f"seg_%03d{ext}"),
+            "-y"
+        ]
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=PROXY_TIMEOUT_SECONDS)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        try:
+            os.replace(tmp_dir, segment_dir)
+        except OSError:
+            # Lost the race to another worker: its (non-empty) directory is already in place
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(segment_dir):
+                raise
+
+    else:
+        _touch(segment_dir)
+
+    segments = []
+    start = 0.0
+    for name in sorted(os.listdir(segment_dir)):
+        path = os.path.join(segment_dir, name)
+        duration = probe_media(path).get("duration") or 0
+        segments.append({"path": path, "start": start, "duration": duration})
+        start += duration
+    return segments
+
+def cut_clip(video_path: str, cache_key: str, seconds: float) -> str:
+    """
+    Copies the first `seconds` of a video into a separate file (stream copy,
+    no re-encode). Used for the quick hook-only analysis. Cached by `cache_key`.
+    """
+    ext = os.path.splitext(video_path)[1] or ".mp4"
+    os.makedirs(SEGMENT_DIR, exist_ok=True)
+    clip_path = os.path.join(SEGMENT_DIR, f"{cache_key}-head{int(seconds)}{ext}")
+    if os.path.exists(clip_path):
+        _touch(clip_path)
+        return clip_path
+
+    tmp_path = f"{clip_path}.{os.getpid()}.tmp{ext}"
+    # ffmpeg -i video.mp4 -t 5 -c copy -map 0 clip.mp4
+    cmd = [
+        FFMPEG_PATH, "-i", video_path,
+        "-t", str(seconds),
+        "-c", "copy", "-map", "0",
+        "-movflags", "+faststart",
+        tmp_path, "-y"
+    ]
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        os.replace(tmp_path, clip_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return clip_path
+
 def extract_audio(video_path: str) -> str:
     """
     Extracts audio from video using ffmpeg.
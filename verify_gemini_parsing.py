@@ -0,0 +1,83 @@
+"""
+Regression checks for parsing Gemini results (services/gemini_analyzer.py).
+Run: python verify_gemini_parsing.py
+"""
+import json
+import sys
+from schemas import VideoAnalysisResult
+from services.gemini_analyzer import JsonSectionParser, TruncatedGeneration, _parse_streamed, _parse_video_response, merge_segment_results, parse_result
+
+def check_missing_subscores_are_omitted():
+    # Only the required hook subscore; delivery etc. left out by the model
+    text = json.dumps({
+        "overall_score": 71,
+        "subscores": {"hook": {"score": 80, "analysis": "Strong open", "tips": []}},
+        "insights": {"executive_summary": "Good"},
+    })
+    result = parse_result(text, VideoAnalysisResult)
+    assert set(result["subscores"]) == {"hook"}, result["subscores"]
+    assert all(isinstance(data, dict) for data in result["subscores"].values())
+    assert "optimized_assets" not in result and "checklist" not in result, result
+    assert "audience_retention_prediction" not in result["insights"], result["insights"]
+
+def _truncated(result: dict):
+    """A streamed response cut off right after its last complete section."""
+    text = json.dumps(result)[:-1] + ', "insights": {"executive_summary": "Cut o'
+    parser = JsonSectionParser()
+    parser.feed(text)
+    return text, parser.sections
+
+def check_truncated_stream_is_not_a_result():
+    text, sections = _truncated({
+        "overall_score": 64,
+        "subscores": {"hook": {"score": 70, "analysis": "Slow start", "tips": []}},
+    })
+    try:
+        result = _parse_streamed(text, sections, _parse_video_response, VideoAnalysisResult)
+    except TruncatedGeneration as e:
+        assert e.sections["overall_score"] == 64, e.sections
+        return
+    raise AssertionError(f"truncated response parsed as a complete result: {result}")
+
+def check_invalid_truncated_sections_fail():
+    # overall_score arrived but the subscores don't match the schema
+    text, sections = _truncated({"overall_score": 64, "subscores": {"delivery": {"score": 50}}})
+    try:
+        _parse_streamed(text, sections, _parse_video_response, VideoAnalysisResult)
+    except TruncatedGeneration:
+        raise AssertionError("invalid sections would be retried as PARTIAL")
+    except ValueError:
+        return
+    raise AssertionError("invalid truncated response was accepted")
+
+def check_merge_without_scores_fails():
+    segments = [{"start": 0, "duration": 180}, {"start": 180, "duration": 120}]
+    results = [{"subscores": {"hook": {"score": 60}}}, {"overall_score": None}]
+    try:
+        merged = merge_segment_results(results, segments)
+    except ValueError:
+        return
+    raise AssertionError(f"merged without any segment score: {merged.get('overall_score')!r}")
+
+def check_fractional_scores_are_rounded():
+    text = json.dumps({
+        "overall_score": 7.5,
+        "subscores": {"hook": {"score": "8.4", "analysis": "Decent", "tips": []}},
+    })
+    result = parse_result(text, VideoAnalysisResult)
+    assert result["overall_score"] == 8, result["overall_score"]
+    assert result["subscores"]["hook"]["score"] == 8, result["subscores"]["hook"]
+
+CHECKS = [check_missing_subscores_are_omitted, check_truncated_stream_is_not_a_result, check_invalid_truncated_sections_fail,
+          check_merge_without_scores_fails, check_fractional_scores_are_rounded]
+
+if __name__ == "__main__":
+    failed = 0
+    for check in CHECKS:
+        try:
+            check()
+            print(f"OK   {check.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {check.__name__}: {e}")
+    sys.exit(1 if failed else 0)
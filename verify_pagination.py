@@ -0,0 +1,59 @@
+"""
+Regression checks for keyset pagination (services/pagination.py) on SQLite.
+Run: python verify_pagination.py
+"""
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from database import Base
+from models import User, Video
+from services.pagination import keyset_page, next_cursor
+
+def _library():
+    """A user with videos sharing one CURRENT_TIMESTAMP second plus some with explicit, sub-second times."""
+    db = Session(create_engine("sqlite://"))
+    Base.metadata.create_all(bind=db.get_bind())
+    user = User(email="pages@example.com", credits=0)
+    db.add(user)
+    db.commit()
+    db.add_all([Video(user_id=user.id, source_type="upload") for _ in range(5)])
+    base = datetime(2020, 1, 1, 12, 0, 0)
+    db.add_all([Video(user_id=user.id, source_type="upload", created_at=base + timedelta(microseconds=250 * i)) for i in range(4)])
+    db.commit()
+    return db, user
+
+def _walk(db, user, limit: int, since: datetime = None) -> list:
+    seen, cursor = [], None
+    while True:
+        rows = keyset_page(db.query(Video).filter(Video.user_id == user.id), Video, cursor, since, limit).all()
+        seen += [video.id for video in rows]
+        cursor = next_cursor(rows, limit)
+        if not cursor:
+            return seen
+        assert len(seen) <= 9, f"no end after {len(seen)} rows: {seen}"
+
+def check_pages_have_no_duplicates():
+    db, user = _library()
+    expected = [video.id for video in db.query(Video).order_by(Video.created_at.desc(), Video.id.desc())]
+    for limit in (1, 2, 4):
+        seen = _walk(db, user, limit)
+        assert seen == expected, f"limit={limit}: {seen} != {expected}"
+
+def check_since_is_exclusive():
+    db, user = _library()
+    seen = _walk(db, user, 2, since=datetime(2020, 1, 1, 12, 0, 0, 250))
+    assert len(seen) == 5 + 2, seen
+
+CHECKS = [check_pages_have_no_duplicates, check_since_is_exclusive]
+
+if __name__ == "__main__":
+    failed = 0
+    for check in CHECKS:
+        try:
+            check()
+            print(f"OK   {check.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {check.__name__}: {e}")
+    sys.exit(1 if failed else 0)
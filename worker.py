@@ -0,0 +1,224 @@
+"""
+Standalone job worker.
+
+Runs queued analysis / link import jobs from the `jobs` table, separately from
+the API process (`uvicorn main:app`):
+
+    python worker.py --workers 4
+
+Each worker process claims jobs and feeds them into a staged pipeline
+(see services/pipeline.py), so many jobs are in flight per process. Jobs left
+behind by a crashed or restarted worker are reclaimed once their lease expires.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from database import SessionLocal, engine, Base
+from models import Analysis, AnalysisStatus
+from services import job_queue, metrics
+from services.events import notify_analysis
+from services.pipeline import PipelineJob, build_pipeline, thread_budget, STAGE_CONCURRENCY
+from routers.uploads import gc_stale_uploads
+from services.link_cache import gc_link_fetches
+from services.video_processor import gc_derived_files
+from services.gemini_files import cleanup_remote_files
+from services.credits import reconcile_credits
+from services import user_stats # registers the listeners that keep user_stats current
+
+POLL_INTERVAL_SECONDS = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+HEARTBEAT_SECONDS = max(job_queue.LEASE_SECONDS // 3, 5)
+MAX_IN_FLIGHT = int(os.getenv("WORKER_MAX_IN_FLIGHT", str(sum(STAGE_CONCURRENCY.values()))))
+JANITOR_INTERVAL_SECONDS = int(os.getenv("WORKER_JANITOR_INTERVAL", "600"))
+METRICS_INTERVAL_SECONDS = int(os.getenv("WORKER_METRICS_INTERVAL", "300"))
+
+KNOWN_KINDS = (job_queue.JOB_ANALYSIS, job_queue.JOB_LINK_IMPORT)
+
+def _claim(worker_id: str):
+    db = SessionLocal()
+    try:
+        return job_queue.claim_job(db, worker_id)
+    finally:
+        db.close()
+
+def _heartbeat_all(job_ids: list, worker_id: str):
+    db = SessionLocal()
+    try:
+        for job_id in job_ids:
+            if not job_queue.heartbeat(db, job_id, worker_id):
+                print(f"[{worker_id}] Lost lease on job {job_id}")
+    finally:
+        db.close()
+
+def _mark_analysis_failed(payload: dict):
+    analysis_id = (payload or {}).get("analysis_id")
+    if not analysis_id:
+        return
+    db = SessionLocal()
+    try:
+        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
+        if analysis and analysis.status != AnalysisStatus.COMPLETED:
+            analysis.status = AnalysisStatus.FAILED
+            notify_analysis(db, analysis)
+            db.commit()
+    finally:
+        db.close()
+
+def _finish_job(job_id: int, worker_id: str, error, retry: bool = False):
+    db = SessionLocal()
+    try:
+        if error is None:
+            if not job_queue.complete_job(db, job_id, worker_id):
+                print(f"[{worker_id}] Job {job_id} was reclaimed by another worker, leaving it to them")
+        else:
+            # Only transient failures are re-run; anything else the pipeline marked FAILED
+            job_queue.fail_job(db, job_id, worker_id, str(error), retry=retry)
+    finally:
+        db.close()
+
+def _reject_job(job, worker_id: str, reason: str):
+    print(f"Rejecting job {job.id}: {reason}")
+    db = SessionLocal()
+    try:
+        job_queue.fail_job(db, job.id, worker_id, reason, retry=False)
+    finally:
+        db.close()
+    _mark_analysis_failed(job.payload)
+
+async def _heartbeat_loop(worker_id: str, in_flight: dict):
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        if not in_flight:
+            continue
+        try:
+            await asyncio.to_thread(_heartbeat_all, list(in_flight), worker_id)
+        except Exception as e:
+            print(f"[{worker_id}] Heartbeat failed: {e}")
+
+def _run_janitor_tasks():
+    db = SessionLocal()
+    try:
+        removed = gc_stale_uploads(db)
+        if removed:
+            print(f"Janitor: removed {removed} stale uploads")
+        evicted = gc_derived_files()
+        if evicted:
+            print(f"Janitor: removed {evicted} unused proxies, segments and clips")
+        expired = gc_link_fetches(db)
+        if expired:
+            print(f"Janitor: forgot {expired} expired link downloads")
+        if os.getenv("GEMINI_API_KEY"):
+            deleted = cleanup_remote_files(db)
+            if deleted:
+                print(f"Janitor: deleted {deleted} orphaned Gemini files")
+        reconciled = reconcile_credits(db)
+        if reconciled["refunded"] or reconciled["adjusted"]:
+            print(f"Janitor: credit ledger reconciled ({reconciled['refunded']} missed refunds, {reconciled['adjusted']} balance entries)")
+    finally:
+        db.close()
+
+async def _janitor_loop(worker_id: str):
+    """
+    Periodic housekeeping. Only one process per worker host runs it.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(_run_janitor_tasks)
+        except Exception as e:
+            print(f"[{worker_id}] Janitor failed: {e}")
+        await asyncio.sleep(JANITOR_INTERVAL_SECONDS)
+
+async def _metrics_loop(worker_id: str):
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL_SECONDS)
+        counters = metrics.snapshot()
+        if counters:
+            print(f"[{worker_id}] Metrics: {counters}")
+
+async def run_worker(worker_id: str, run_janitor: bool = False):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=thread_budget()))
+
+    in_flight = {}
+    slots = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    async def on_finish(job: PipelineJob, error):
+        in_flight.pop(job.job_id, None)
+        slots.release()
+        await asyncio.to_thread(_finish_job, job.job_id, worker_id, error, job.retry)
+        outcome = "ok" if error is None else "failed, will retry" if job.retry else "failed"
+        print(f"[{worker_id}] Finished job {job.job_id} ({outcome})")
+
+    pipeline = build_pipeline(on_finish)
+    pipeline.start()
+    heartbeat_task = asyncio.create_task(_heartbeat_loop(worker_id, in_flight))
+    janitor_task = asyncio.create_task(_janitor_loop(worker_id)) if run_janitor else None
+    metrics_task = asyncio.create_task(_metrics_loop(worker_id))
+
+    while True:
+        await slots.acquire()
+        try:
+            job = await asyncio.to_thread(_claim, worker_id)
+        except Exception as e:
+            print(f"[{worker_id}] Claim failed: {e}")
+            job = None
+
+        if job is None:
+            slots.release()
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            continue
+
+        if job.kind not in KNOWN_KINDS:
+            slots.release()
+            await asyncio.to_thread(_reject_job, job, worker_id, f"Unknown job kind: {job.kind}")
+            continue
+        if job.attempts > job_queue.MAX_ATTEMPTS:
+            slots.release()
+            await asyncio.to_thread(_reject_job, job, worker_id, f"Exceeded {job_queue.MAX_ATTEMPTS} attempts")
+            continue
+
+        print(f"[{worker_id}] Claimed {job.kind} job {job.id} (attempt {job.attempts}), queues: {pipeline.queue_depths()}")
+        pipeline_job = PipelineJob(job.id, job.payload or {}, job.attempts)
+        in_flight[job.id] = pipeline_job
+        await pipeline.submit(pipeline_job)
+
+def worker_process(index: int):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    print(f"Worker {worker_id} started")
+    # Each process needs its own connections, never the parent's
+    engine.dispose()
+    asyncio.run(run_worker(worker_id, run_janitor=(index == 0)))
+
+def main():
+    parser = argparse.ArgumentParser(description="ViralRadar background job worker")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKER_PROCESSES", "2")))
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    # The Gemini quota is per project: every worker process limits itself to its share
+    os.environ.setdefault("GEMINI_RATE_SHARE", str(max(1, args.workers)))
+    # Same for the per-site download limits
+    os.environ.setdefault("DOWNLOAD_RATE_SHARE", str(max(1, args.workers)))
+
+    if args.workers <= 1:
+        worker_process(0)
+        return
+
+    processes = []
+    for i in range(args.workers):
+        p = multiprocessing.Process(target=worker_process, args=(i,), daemon=True)
+        p.start()
+        processes.append(p)
+
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        print("Shutting down workers...")
+        for p in processes:
+            p.terminate()
+
+if __name__ == "__main__":
+    main()